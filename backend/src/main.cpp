@@ -1,6 +1,7 @@
 #include "gtfs_files.h"
 #include "routes_loader.h"
 #include "stop_times_loader.h"
+#include "table_export.h"
 #include "trips_loader.h"
 #include <memory>
 
@@ -10,32 +11,11 @@ std::unique_ptr<trips_loader::table_trips> trips;
 std::unique_ptr<trips_loader::table_trip_index> trip_index;
 std::unique_ptr<trips_loader::table_trips_by_hour> trips_by_hour;
 std::unique_ptr<routes_loader::table_itineraries> itineraries;
+std::vector<table_export::table> exported;
 
 extern "C" {
-const char *serve_trip(int trip_id) { return trips->at(trip_id).c_str(); }
-
-const char *serve_itinerary(int itinerary_id) {
-  return itineraries->at(itinerary_id).c_str();
-}
-
-const char *serve_trip_index(const char *trip_id) {
-  if (auto trip_it = trip_index->find(trip_id); trip_it != trip_index->end()) {
-    return trip_it->second.c_str();
-  } else {
-    return "\"NOT_FOUND\"";
-  }
-}
-
-const char *serve_trips_by_hour(const char *route_id, const char *service_id) {
-  if (auto trips_it = trips_by_hour->find({route_id, service_id});
-      trips_it != trips_by_hour->end()) {
-    return trips_it->second.c_str();
-  } else {
-    return "";
-  }
-}
-
-void generate_all(const char *gtfs_dir, const char *out_dir) {
+// returns the number of stop_times.txt rows read
+std::uint64_t generate_all(const char *gtfs_dir, const char *out_dir) {
   gtfs::stops stops_csv(gtfs_dir);
   gtfs::trips trips_csv(gtfs_dir);
   gtfs::routes routes_csv(gtfs_dir);
@@ -48,5 +28,39 @@ void generate_all(const char *gtfs_dir, const char *out_dir) {
 
   routes_loader::gen_routes(out_dir, analysis, routes_csv);
   itineraries = routes_loader::gen_itineraries(analysis);
+  return analysis.stop_times_rows;
+}
+
+// tables in order: trips, itineraries, trip_index, trips_by_hour.
+// the exported copies stay valid until the next export_tables call
+int export_tables() {
+  exported.clear();
+  exported.push_back(table_export::from(*trips));
+  exported.push_back(table_export::from(*itineraries));
+  exported.push_back(table_export::from(*trip_index));
+  exported.push_back(table_export::from(*trips_by_hour));
+  return exported.size();
+}
+
+std::uint64_t exported_table(int table, const char **keys,
+                             const std::uint64_t **key_offsets,
+                             const char **values,
+                             const std::uint64_t **value_offsets) {
+  const auto &exported_table = exported.at(table);
+  *keys = exported_table.keys.data();
+  *key_offsets = exported_table.key_offsets.data();
+  *values = exported_table.values.data();
+  *value_offsets = exported_table.value_offsets.data();
+  return exported_table.value_offsets.size() - 1;
+}
+
+// frees every table, for when python holds its own copy of the exported ones
+void release_tables() {
+  trips.reset();
+  trip_index.reset();
+  trips_by_hour.reset();
+  itineraries.reset();
+  exported.clear();
+  exported.shrink_to_fit();
 }
 }
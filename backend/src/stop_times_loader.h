@@ -4,6 +4,7 @@
 #include <algorithm>
 #include <charconv>
 #include <cstddef>
+#include <cstdint>
 #include <iostream>
 #include <jsonxx.h>
 #include <map>
@@ -98,6 +99,7 @@ public:
   struct analysis_t {
     std::map<itinerary_key, itinerary> itineraries;
     std::unordered_map<const gtfs::entry *, trip> trips;
+    std::uint64_t stop_times_rows = 0;
   };
 
   static analysis_t load(const std::string &gtfs_dir,
@@ -109,6 +111,7 @@ public:
     gtfs::stop_times cells(gtfs_dir);
 
     while (cells.read()) {
+      ++analysis.stop_times_rows;
       auto stop_id = strip(cells.stop_id->as_str());
       auto stop_it = stops_csv.find(stop_id);
       if (stop_it == stops_csv.end()) {
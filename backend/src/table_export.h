@@ -0,0 +1,57 @@
+/** Copies the serving tables into one contiguous buffer of keys and one of
+ *  values, each with an offset index, so that Python can read any entry as a
+ *  slice of memory it already holds instead of calling into the library per
+ *  request. Entry i of a table is values[value_offsets[i]:value_offsets[i + 1]],
+ *  keyed by keys[key_offsets[i]:key_offsets[i + 1]] (empty for vector tables).
+ *  A (route_jkey, service_jkey) key is exported as "route_jkey\tservice_jkey".
+ */
+#ifndef table_export_h
+#define table_export_h
+#include <cstdint>
+#include <string>
+#include <type_traits>
+#include <vector>
+
+namespace npvis::table_export {
+struct table {
+  std::string keys;
+  std::string values;
+  std::vector<std::uint64_t> key_offsets{0};
+  std::vector<std::uint64_t> value_offsets{0};
+
+  void add(const std::string &key, const std::string &value) {
+    keys += key;
+    values += value;
+    key_offsets.push_back(keys.size());
+    value_offsets.push_back(values.size());
+  }
+};
+
+table from(const std::vector<std::string> &rows) {
+  table exported;
+  std::size_t size = 0;
+  for (const auto &row : rows) {
+    size += row.size();
+  }
+  exported.values.reserve(size);
+  exported.key_offsets.reserve(rows.size() + 1);
+  exported.value_offsets.reserve(rows.size() + 1);
+  for (const auto &row : rows) {
+    exported.add("", row);
+  }
+  return exported;
+}
+
+template <typename Map> table from(const Map &rows) {
+  table exported;
+  for (const auto &[key, value] : rows) {
+    if constexpr (std::is_same_v<typename Map::key_type, std::string>) {
+      exported.add(key, value);
+    } else {
+      exported.add(key.first + '\t' + key.second, value);
+    }
+  }
+  return exported;
+}
+} // namespace npvis::table_export
+#endif
@@ -60,7 +60,7 @@ function onEnterTime() {
 function onEnterTripId() {
   const tripId = document.getElementById('trip_search').value;
   if (tripId.length > 0) {
-    loadJsonFileAsObj(`/.visualizefiles/trip_index/${tripId}.json`,
+    loadJsonFileAsObj(`./.visualizefiles/trip_index/${tripId}.json`,
         (tripJkey) => {
     addInputData('trip_search', 'trip_entered', 'tripbutton', tripId);
     showTrip(tripJkey);
@@ -58,11 +58,13 @@ function expandTripInfo(tripJkey) {
     if (cachedTripInfo[tripJkey]) {
       displayTripInfo(cachedTripInfo[tripJkey], tripJkey);
     } else {
-      loadJsonFileAsObj(`./.visualizefiles/trips/${tripJkey}.json`, (trip) => {
-        displayTripInfo(trip, tripJkey);
-      }, () => {
-        document.getElementById('trip_info').innerHTML += '<br><span class="error>Could not load trip info</span>';
-        tripExpanded = true;
+      loadBatch([tripJkey], [], null, (batch) => {
+        if (batch.trips[tripJkey]) {
+          displayTripInfo(batch.trips[tripJkey], tripJkey);
+        } else {
+          document.getElementById('trip_info').innerHTML += '<br><span class="error>Could not load trip info</span>';
+          tripExpanded = true;
+        }
       });
     }
   } else {
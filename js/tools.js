@@ -12,11 +12,55 @@ function loadJsonFileAsObj(path, onSuccess, onFail) {
       }
     }
   };
-  xhr.open("GET", path + '?cache=' + cacheId, true);
+  xhr.open("GET", path + (path.includes('?') ? '&' : '?') + 'cache=' + cacheId, true);
   xhr.send();
   addInputEventListeners(); 
 }
 
+// load many trips and itineraries in one request, call onSuccess with
+// {trips: {tripJkey: trip}, itineraries: {itineraryId: itinerary}}; ids that could not be
+// loaded are left out. falls back to one request per id if the batch endpoint is not there
+function loadBatch(tripJkeys, itineraryIds, routeJkey, onSuccess) {
+  const xhr = new XMLHttpRequest();
+  xhr.onreadystatechange = () => {
+    if (xhr.readyState === XMLHttpRequest.DONE) {
+      if (xhr.status === 200) {
+        onSuccess(JSON.parse(xhr.responseText));
+      } else {
+        loadEach(tripJkeys, itineraryIds, routeJkey, onSuccess);
+      }
+    }
+  };
+  xhr.open('POST', './.visualizefiles/batch', true);
+  xhr.setRequestHeader('Content-Type', 'application/json');
+  xhr.send(JSON.stringify({trips: tripJkeys, itineraries: itineraryIds}));
+  addInputEventListeners();
+}
+
+function loadEach(tripJkeys, itineraryIds, routeJkey, onSuccess) {
+  const batch = {trips: {}, itineraries: {}};
+  const total = tripJkeys.length + itineraryIds.length;
+  let processed = 0;
+  const done = () => {
+    processed += 1;
+    if (processed === total) onSuccess(batch);
+  };
+
+  if (total === 0) onSuccess(batch);
+  tripJkeys.forEach((tripJkey) => {
+    loadJsonFileAsObj(`./.visualizefiles/trips/${tripJkey}.json`, (trip) => {
+      batch.trips[tripJkey] = trip;
+      done();
+    }, done);
+  });
+  itineraryIds.forEach((itineraryId) => {
+    loadJsonFileAsObj(`./.visualizefiles/itineraries/${routeJkey}/itin_${itineraryId}.json`, (itin) => {
+      batch.itineraries[itineraryId] = itin;
+      done();
+    }, done);
+  });
+}
+
 // calculate the time after a HH:MM:SS given a number of seconds after it
 function getNextTime(prevTime, secOffset) {
   timeSplit = prevTime.split(':');
@@ -41,23 +85,49 @@ function getNextTime(prevTime, secOffset) {
 }
 
 // map manipulation tools
-function zoomToGeojson(geojson) {
+const fitPadding = {top: 25, bottom: 25, left: 300, right: 25};
+
+function geojsonBounds(geojson) {
   const coordinates = geojson['geometry']['coordinates'];
-  const bounds = coordinates.reduce(function(bounds, coord) {
+  return coordinates.reduce(function(bounds, coord) {
     return bounds.extend(coord);
   }, new mapboxgl.LngLatBounds(coordinates[0], coordinates[0]));
-  map.fitBounds(bounds, {
-    padding: {top: 25, bottom: 25, left: 300, right: 25},
+}
+
+function zoomToGeojson(geojson) {
+  map.fitBounds(geojsonBounds(geojson), {
+    padding: fitPadding,
     linear: true,
   });
 }
 
+// the zoom zoomToGeojson will end up at
+function fittedZoom(geojson) {
+  const camera = map.cameraForBounds(geojsonBounds(geojson), {padding: fitPadding});
+  return camera ? camera.zoom : map.getZoom();
+}
+
+// shapes are simplified for these zooms, see tools/shape_simplify.py; past the last one
+// the full shape is used. returns the level to fetch for a zoom, Infinity for full
+const SHAPE_LEVELS = [8, 10, 12];
+
+function shapeLevel(zoom) {
+  const level = SHAPE_LEVELS.find((level) => zoom <= level);
+  return level === undefined ? Infinity : level;
+}
+
+function shapePath(shapeJkey, level) {
+  const path = `./.visualizefiles/shapes/${shapeJkey}.json`;
+  return level === Infinity ? path : `${path}?zoom=${level}`;
+}
+
 function removeShape() {
   map.removeLayer('shape');
   map.removeLayer('shape-line');
   map.removeSource('shape');
 
   shapeShown = false;
+  shownShape = null;
 }
 
 function removeStops() {
@@ -79,6 +149,24 @@ function clearMap() {
 
 // geographic tools
 
+// stops are split into slippy map tiles, see tools/stop_tiles.py; tiles at this zoom hold every stop
+const STOP_TILE_ZOOM = 14;
+
+const STOP_INDEX_SHARDS = 256;
+
+function stopTilePath(x, y) {
+  return `./.visualizefiles/stops/tiles/${STOP_TILE_ZOOM}/${x}/${y}.json`;
+}
+
+// the index file holding the [x, y] of a stop's tile, by stop_id; same hash as stop_shard in tools/stop_tiles.py
+function stopIndexPath(stopId) {
+  let h = 0;
+  for (let i = 0; i < stopId.length; i++) {
+    h = (Math.imul(h, 31) + stopId.charCodeAt(i)) >>> 0;
+  }
+  return `./.visualizefiles/stops/tiles/index/${h % STOP_INDEX_SHARDS}.json`;
+}
+
 // given a stop list, create a geojson of lines between the stops
 function createShapeOfStops(stopList) {
   const shapeJson = {
@@ -4,6 +4,7 @@ const cacheId = parseInt(Math.random() * 1000000).toString();
 
 // state trackers
 let shapeShown = false; // whether or not a shape is drawn on the map
+let shownShape = null; // shape_jkey and simplification level of the shape drawn on the map
 let stopsShown = false; // whether or not there are stops drawn on the map
 let timePopups = []; // array of mapbox popups showing times at each stop
 let activeTrip = ''; // the trip currently displayed on the map
@@ -24,6 +25,20 @@ const map = new mapboxgl.Map({
   zoom: 2, // starting zoom
 });
 
+// swap in a more detailed shape when zooming in past its simplification level
+map.on('zoomend', function() {
+  if (!shownShape || shapeLevel(map.getZoom()) <= shownShape.level) return;
+
+  const shapeJkey = shownShape.shapeJkey;
+  const level = shapeLevel(map.getZoom());
+  shownShape.level = level;
+  loadJsonFileAsObj(shapePath(shapeJkey, level), (shapeJson) => {
+    if (shownShape && shownShape.shapeJkey === shapeJkey) {
+      map.getSource('shape').setData(shapeJson);
+    }
+  }, () => {});
+});
+
 // add the stop image for when stops get displayed
 map.on('load', function() {
   map.loadImage('./files/img/stop-50.png', function(error, image) {
@@ -148,42 +163,40 @@ function groupTripsByItineraryAndDisplay(trips, routeJkey) {
     return;
   }
   const first3TripsByItinId = {};
-  let processed = 0;
-  trips.forEach((tripJkey) => {
-    loadJsonFileAsObj(`./.visualizefiles/trips/${tripJkey}.json`, (trip) => {
+  loadBatch(trips, [], routeJkey, (batch) => {
+    trips.forEach((tripJkey) => {
+      const trip = batch.trips[tripJkey];
+      if (!trip) {
+        console.log(`Could not find trip file for tripJkey ${tripJkey}`);
+        return;
+      }
       const itineraryId = trip['itinerary_id'];
-      
+
       if (!first3TripsByItinId[itineraryId]) {
         first3TripsByItinId[itineraryId] = [];
       }
       if (first3TripsByItinId[itineraryId].length < 3) {
         first3TripsByItinId[itineraryId].push(trip);
       }
-
-      processed += 1;
-      if (processed === trips.length) {
-        displayItineraries(first3TripsByItinId, routeJkey);
-      }
-    }, () => {
-      console.log(`Could not find trip file for tripJkey ${tripJkey}`);
-
-      processed += 1;
-      if (processed === trips.length) {
-        displayItineraries(first3TripsByItinId, routeJkey);
-      }
     });
+
+    displayItineraries(first3TripsByItinId, routeJkey);
   });
 }
 
 // shows the itineraries and their (max 3) trips in the html, adding onclick events for each trip
 function displayItineraries(first3TripsByItinId, routeJkey) {
   cachedTripInfo = {};
-  Object.keys(first3TripsByItinId).forEach((itineraryId) => {
-    const sorted3Trips = first3TripsByItinId[itineraryId].sort((a, b) => { return a['departure_time'].localeCompare(b['departure_time']); });
-    let tableElement = '<tr><td class="itin_name">';
-    
-    const filePath = `./.visualizefiles/itineraries/${routeJkey}/itin_${itineraryId}.json`;
-    loadJsonFileAsObj(filePath, (itin) => {
+  const itineraryIds = Object.keys(first3TripsByItinId);
+  loadBatch([], itineraryIds, routeJkey, (batch) => {
+    itineraryIds.forEach((itineraryId) => {
+      const itin = batch.itineraries[itineraryId];
+      if (!itin) {
+        alert('Could not load itinerary file.');
+        return;
+      }
+      const sorted3Trips = first3TripsByItinId[itineraryId].sort((a, b) => { return a['departure_time'].localeCompare(b['departure_time']); });
+      let tableElement = '<tr><td class="itin_name">';
       tableElement += `${itin['itinerary_name']}:</td></tr><tr><td class="departure_times">`;
       
       sorted3Trips.forEach((trip) => {
@@ -195,8 +208,6 @@ function displayItineraries(first3TripsByItinId, routeJkey) {
 
       tableElement += '</td></tr>';
       document.getElementById('itins_table').innerHTML += tableElement;
-    }, () => {
-      alert('Could not load itinerary file.');
     });
   });
 }
@@ -278,10 +289,13 @@ function displayTrip(itin, tripJkey) {
   const timingList = trip['timing_list'];
   const depTime = trip['departure_time'];
   if (itin['shape_jkey']) {
-    const filePath = `./.visualizefiles/shapes/${itin['shape_jkey']}.json`;
+    // fetch the shape simplified for the zoom the map is about to fit to
+    const level = stopList.length ? shapeLevel(fittedZoom(createShapeOfStops(stopList))) : Infinity;
+    const filePath = shapePath(itin['shape_jkey'], level);
     
     loadJsonFileAsObj(filePath, (shapeJson) => {
       addShapeToMap(shapeJson);
+      shownShape = {shapeJkey: itin['shape_jkey'], level};
       displayStopsAndZoomTo(stopList, timingList, depTime, shapeJson);
     }, () => {
       const shapeJson = createShapeOfStops(stopList);
@@ -379,12 +393,9 @@ function createStopPopup(stopId, coordinates) {
     'bottom': [0, -7.5],
   };
 
-  const pathToStopsFile = './.visualizefiles/stops/stops.json';
-  loadJsonFileAsObj(pathToStopsFile, (stops) => {
-    const stop = stops[stopId];
-
+  const showPopup = (stop) => {
     if (!stop) {
-      return content += '<span class="error">Could not get stop info.</span></div>';
+      content += '<span class="error">Could not get stop info.</span></div>';
     } else {
       content += `<span class="stop_name">${stop['stop_name']}</span> <span class="stop_id">(${stopId})</span><br>`;
       content += `${coordinates[0]},<br>${coordinates[1]}`;
@@ -395,12 +406,16 @@ function createStopPopup(stopId, coordinates) {
       .setLngLat(coordinates)
       .setHTML(content)
       .addTo(map);
-  }, () => {
-    content += '<span class="error">Could not get stop info.</span></div>';
+  };
 
-    new mapboxgl.Popup({ offset: popupOffsets, closeButton: false })
-      .setLngLat(coordinates)
-      .setHTML(content)
-      .addTo(map);
-  });
+  // only the tile containing the stop is fetched, not the whole stops.json. it is
+  // looked up by stop_id: the clicked coordinates are rounded and may fall in the next tile
+  loadJsonFileAsObj(stopIndexPath(stopId), (tiles) => {
+    const tile = tiles[stopId];
+    if (!tile) {
+      showPopup(null);
+      return;
+    }
+    loadJsonFileAsObj(stopTilePath(tile[0], tile[1]), (stops) => showPopup(stops[stopId]), () => showPopup(null));
+  }, () => showPopup(null));
 }
@@ -0,0 +1,51 @@
+import threading
+import flask
+from tools import metrics
+
+# With VIZ_PROFILE_SLOW_MS set, requests are profiled, but a process can only
+# run one profiler at a time: a request overlapping a profiled one must still
+# be served, just without a profile of its own.
+
+
+def test_overlapping_requests_are_served_while_profiling(monkeypatch, tmp_path):
+    monkeypatch.setattr(metrics, "profile_slow_ms", 1e9)
+    monkeypatch.setattr(metrics, "profile_dir", str(tmp_path))
+
+    app = flask.Flask(__name__)
+    metrics.instrument(app)
+    first_in = threading.Event()
+    second_done = threading.Event()
+
+    @app.route("/first")
+    def first():
+        first_in.set()
+        second_done.wait(10)
+        return "profiled" if "metrics_profile" in flask.g else "not profiled"
+
+    @app.route("/second")
+    def second():
+        return "profiled" if "metrics_profile" in flask.g else "not profiled"
+
+    @app.route("/fails")
+    def fails():
+        raise RuntimeError("fails")
+
+    results = {}
+
+    def get_first():
+        results["first"] = app.test_client().get("/first")
+
+    thread = threading.Thread(target=get_first)
+    thread.start()
+    assert first_in.wait(10)
+    results["second"] = app.test_client().get("/second")
+    second_done.set()
+    thread.join(10)
+
+    assert (results["first"].status_code, results["first"].data) == (200, b"profiled")
+    assert (results["second"].status_code, results["second"].data) == (200, b"not profiled")
+
+    # the profiler is free again, also after a view that raised
+    assert app.test_client().get("/fails").status_code == 500
+    assert app.test_client().get("/second").data == b"profiled"
+    assert not metrics.profile_lock.locked()
@@ -0,0 +1,139 @@
+import ctypes
+import json
+import os
+import pytest
+from tools import payload_tables
+from tools.id_registry import registry as ids
+from tools.python_engine import PythonEngine
+
+# The python engine against libvis on a small feed: both must serve the same
+# trips, trip_index, trips_by_hour and itineraries, and write the same routes.
+# Which itinerary gets which id, and which of its trips' shapes it carries,
+# follow hash map order in libvis, so itineraries are compared by content and
+# trips through them. So do the key order of a route file and the trips picked
+# as its samples: routes are compared as parsed JSON, and the samples checked
+# to be up to three trips of each of the route's itineraries.
+
+libvis_path = os.path.join(os.path.dirname(__file__), "..", "backend", "lib", "libvis.so")
+
+
+def write_feed(feed_dir):
+    stops = ["stop_id,stop_name,stop_lat,stop_lon"]
+    stops += ['S%d,"Stop ""%d""",45.%04d,-73.%04d' % (i, i, 5000 + 37 * i, 6000 + 41 * i) for i in range(12)]
+    routes = ["route_id,route_short_name,route_long_name,route_type", "R1,1,One,3", "R2,2,Two,3", "R3,3,Three,1"]
+    trips = ["route_id,service_id,trip_id,trip_headsign,shape_id"]
+    stop_times = ["trip_id,arrival_time,departure_time,stop_id,stop_sequence"]
+    patterns = {"R1": [0, 1, 2, 3, 4], "R2": [5, 6, 7, 8], "R3": [9, 10, 11, 2]}
+    for n in range(36):
+        route = "R%d" % (n % 3 + 1)
+        stop_list = patterns[route] if n % 4 else patterns[route][::-1]
+        service = "WEEK" if n % 5 else "SUN"
+        trips.append("%s,%s,T%d,Towards %d,SH%d" % (route, service, n, stop_list[-1], n % 4))
+        # late trips run past 24:00:00; every seventh trip only has departure times
+        start = 5 * 3600 + n * 2400
+        for i, stop in enumerate(stop_list):
+            time = start + i * (90 + 30 * (n % 3))
+            clock = "%02d:%02d:%02d" % (time // 3600, time // 60 % 60, time % 60)
+            arrival = "" if n % 7 == 0 and i else clock
+            stop_times.append("T%d,%s,%s,S%d,%d" % (n, arrival, clock, stop, 10 * (i + 1)))
+    # a trip without stop times, and stop times of trips or stops that do not exist
+    trips.append("R1,WEEK,EMPTY,Nowhere,")
+    stop_times.append("MISSING,08:00:00,08:00:00,S1,1")
+    stop_times.append("T1,23:00:00,23:00:00,NOSTOP,99")
+
+    for name, lines in [("stops.txt", stops), ("routes.txt", routes), ("trips.txt", trips), ("stop_times.txt", stop_times)]:
+        with open(os.path.join(feed_dir, name), "w") as f:
+            f.write("\n".join(lines) + "\n")
+
+
+def build(engine, feed_dir, out_dir):
+    os.makedirs(os.path.join(out_dir, "routes"))
+    ids.clear()
+    engine.generate_all(str(feed_dir).encode(), str(out_dir).encode())
+    tables = payload_tables.export(engine, copy=True)
+    routes = {}
+    for name in os.listdir(os.path.join(out_dir, "routes")):
+        with open(os.path.join(out_dir, "routes", name)) as f:
+            routes[name] = json.load(f)
+    return {name: tables[name] for name in payload_tables.table_names}, routes
+
+
+def payloads(table):
+    return [json.loads(bytes(table.get(row))) if len(table.get(row)) else None for row in range(len(table))]
+
+
+def keyed(table):
+    return {key: json.loads(bytes(table.get(row))) for key, row in table.row_by_key.items()}
+
+
+@pytest.mark.skipif(not os.path.exists(libvis_path), reason="backend/lib/libvis.so is not built")
+def test_python_engine_matches_libvis(tmp_path):
+    feed_dir = tmp_path / "feed"
+    feed_dir.mkdir()
+    write_feed(feed_dir)
+
+    libvis = ctypes.CDLL(libvis_path)
+    payload_tables.declare(libvis)
+    expected, expected_routes = build(libvis, feed_dir, tmp_path / "libvis")
+    actual, actual_routes = build(PythonEngine(), feed_dir, tmp_path / "python")
+
+    def canonical(itinerary):
+        return json.dumps(dict(itinerary, shape_jkey=None), sort_keys=True)
+
+    expected_itineraries = [canonical(itinerary) for itinerary in payloads(expected["itineraries"])]
+    actual_itineraries = [canonical(itinerary) for itinerary in payloads(actual["itineraries"])]
+    assert sorted(actual_itineraries) == sorted(expected_itineraries)
+
+    def trips(tables, itineraries):
+        trips = payloads(tables["trips"])
+        for trip in trips:
+            if trip is not None:
+                trip["itinerary_id"] = itineraries[trip["itinerary_id"]]
+        return trips
+
+    expected_trips = trips(expected, expected_itineraries)
+    actual_trips = trips(actual, actual_itineraries)
+    assert actual_trips == expected_trips
+    assert sum(trip is not None for trip in actual_trips) == 36
+
+    # an itinerary carries the shape of one of its trips
+    shapes = {}
+    for trip in actual_trips:
+        if trip is not None:
+            shapes.setdefault(trip["itinerary_id"], set()).add(trip["shape_jkey"])
+    for itinerary, canonical_itinerary in zip(payloads(actual["itineraries"]), actual_itineraries):
+        assert itinerary["shape_jkey"] in shapes[canonical_itinerary]
+
+    assert keyed(actual["trip_index"]) == keyed(expected["trip_index"])
+
+    def by_hour(table):
+        return {key: {hour: sorted(trips) for hour, trips in hours.items()} for key, hours in keyed(table).items()}
+
+    assert by_hour(actual["trips_by_hour"]) == by_hour(expected["trips_by_hour"])
+
+    def samples(routes, trips):
+        itineraries = {}
+        for route in routes.values():
+            for jkey in route.pop("sample_trip_jkeys"):
+                trip = trips[int(jkey)]
+                assert trip["route_id"] == route["route_id"]
+                itineraries.setdefault(route["route_id"], []).append((trip["itinerary_id"], jkey))
+        return itineraries
+
+    expected_samples = samples(expected_routes, expected_trips)
+    actual_samples = samples(actual_routes, actual_trips)
+    assert actual_routes == expected_routes
+    assert len(actual_routes) == 3
+
+    route_itineraries = {}
+    for row, trip in enumerate(actual_trips):
+        if trip is not None:
+            route_itineraries.setdefault(trip["route_id"], {}).setdefault(trip["itinerary_id"], set()).add(str(row))
+    for route_samples in (actual_samples, expected_samples):
+        assert set(route_samples) == set(route_itineraries)
+        for route_id, picked in route_samples.items():
+            assert len(set(picked)) == len(picked)
+            for itinerary, trips_of_itinerary in route_itineraries[route_id].items():
+                jkeys = {jkey for picked_itinerary, jkey in picked if picked_itinerary == itinerary}
+                assert jkeys <= trips_of_itinerary
+                assert len(jkeys) == min(3, len(trips_of_itinerary))
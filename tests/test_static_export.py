@@ -0,0 +1,84 @@
+import json
+import os
+from tools import payload_tables, static_export
+from tools.feeds import Feed
+from tools.id_registry import id_tojkey, registry as ids
+from tools.python_engine import PythonEngine
+from tools.service_calendar import ServiceCalendar, parse_date
+
+# A static export must answer what the live server answers: from its own file
+# where it has one, else from the manifest's fallback for the path.
+
+
+def write_feed(feed_dir):
+    files = {
+        "stops.txt": ["stop_id,stop_name,stop_lat,stop_lon", "S1,One,45.5,-73.6", "S2,Two,45.6,-73.5"],
+        "routes.txt": ["route_id,route_short_name,route_long_name,route_type", "R1,1,One,3", "R2,2,Two,3"],
+        "trips.txt": ["route_id,service_id,trip_id", "R1,WEEKDAY,T1", "R1,WEEKDAY,T2", "R2,WEEKEND,T3"],
+        "stop_times.txt": ["trip_id,arrival_time,departure_time,stop_id,stop_sequence"]
+        + ["%s,0%d:00:00,0%d:00:00,S1,1" % (trip, hour, hour) for trip, hour in [("T1", 7), ("T2", 8), ("T3", 9)]]
+        + ["%s,0%d:30:00,0%d:30:00,S2,2" % (trip, hour, hour) for trip, hour in [("T1", 7), ("T2", 8), ("T3", 9)]],
+    }
+    for name, lines in files.items():
+        with open(os.path.join(feed_dir, name), "w") as f:
+            f.write("\n".join(lines) + "\n")
+
+
+def build_feed(tmp_path):
+    feed_dir, out_dir = tmp_path / "feed", tmp_path / "out"
+    feed_dir.mkdir()
+    os.makedirs(out_dir / "routes")
+    write_feed(feed_dir)
+
+    ids.clear()
+    engine = PythonEngine()
+    engine.generate_all(str(feed_dir).encode(), str(out_dir).encode())
+    tables = payload_tables.take(engine)
+
+    # the week of monday 20240101: WEEKDAY runs monday to friday, WEEKEND the rest
+    monday = parse_date("20240101")
+    weekday, weekend = ids.services.intern("WEEKDAY"), ids.services.intern("WEEKEND")
+    periods = [(weekday, monday, monday + 6, [1, 1, 1, 1, 1, 0, 0]), (weekend, monday, monday + 6, [0, 0, 0, 0, 0, 1, 1])]
+    calendar = ServiceCalendar.build(list(ids.services.jkeys), periods, {})
+    return Feed(None, "test", str(out_dir), calendar, ids.copy(), None, tables)
+
+
+def test_missing_trips_by_date_resolve_through_fallback(tmp_path, monkeypatch):
+    feed = build_feed(tmp_path)
+    # the page's js and css are copied from the working directory
+    monkeypatch.chdir(tmp_path)
+    export_dir = tmp_path / "export"
+    static_export.export(feed, str(export_dir), threads=2)
+    with open(export_dir / "manifest.json") as f:
+        manifest = json.load(f)
+
+    def resolve(path):
+        if path in manifest["files"]:
+            assert os.path.samefile(export_dir / path, export_dir / manifest["files"][path])
+            with open(export_dir / path, "rb") as f:
+                return f.read()
+        for prefix, fallback in manifest["fallbacks"].items():
+            if path.startswith(prefix):
+                with open(export_dir / fallback, "rb") as f:
+                    return f.read()
+        return None
+
+    r1, r2 = id_tojkey("R1"), id_tojkey("R2")
+    trips_by_date = [path for path in manifest["files"] if path.startswith(".visualizefiles/trips_by_date/")]
+    # R1 runs monday to friday and R2 on the weekend: only those days are files
+    assert len(trips_by_date) == 7
+    for date, route_jkey, has_file in [
+        ("20240102", r1, True),
+        ("20240102", r2, False),
+        ("20240106", r1, False),
+        ("20240106", r2, True),
+        ("20250101", r1, False),
+        ("20240102", "no-such-route", False),
+    ]:
+        path = ".visualizefiles/trips_by_date/%s/%s.json" % (date, route_jkey)
+        assert (path in manifest["files"]) == has_file
+        assert resolve(path) == bytes(feed.trips_on_date(date, route_jkey))
+    assert resolve(".visualizefiles/trips_by_date/20240102/%s.json" % r2) == b"[]"
+
+    assert resolve(".visualizefiles/trip_index/T1.json") == bytes(feed.tables["trip_index"].lookup("T1"))
+    assert resolve(".visualizefiles/trip_index/T9.json") == b'"NOT_FOUND"'
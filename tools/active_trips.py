@@ -0,0 +1,147 @@
+import json
+import numpy
+from .id_registry import id_tojkey
+from .service_calendar import format_date, parse_date
+
+# Which trips of a feed are running at a given moment, network wide. Trips are
+# grouped by service, then by duration class (durations between two consecutive
+# powers of two), and sorted by departure. Within a group, knowing its longest
+# trip, the trips running at t are among those departing between t - longest
+# and t: two binary searches find that slice and only it is filtered on
+# arrival. A trip of a class departing in the last half of that window is
+# certainly running, so at most about as many are looked at as are found, and a
+# long night trip only widens the window of its own class. Times past 24:00:00
+# belong to the previous service day, so a moment is also looked up at t + 24h
+# among the previous date's services.
+#
+# Built from a feed's trips and itineraries tables, whichever engine made them.
+# A trip's timing_list and its itinerary's stop_list are kept as flat arrays,
+# so where the running trips are is computed for all of them at once: the
+# last stop each reached, or its position interpolated towards the next.
+
+day_seconds = 24 * 3600
+
+
+def parse_time(time):
+    h, m, s = time.split(":")
+    return 3600 * int(h) + 60 * int(m) + int(s)
+
+
+class ActiveTrips:
+    def __init__(self, trips_table, itineraries_table):
+        service_jkeys = {}
+        self.service_slots = {}
+        rows, slots, starts, itinerary_ids, timing_lists = [], [], [], [], []
+        self.route_jkeys = []
+        for row in range(len(trips_table)):
+            payload = trips_table.get(row)
+            if not payload:
+                continue
+            trip = json.loads(bytes(payload))
+            service_jkey = service_jkeys.get(trip["service_id"])
+            if service_jkey is None:
+                service_jkey = service_jkeys[trip["service_id"]] = id_tojkey(trip["service_id"])
+            rows.append(row)
+            slots.append(self.service_slots.setdefault(service_jkey, len(self.service_slots)))
+            starts.append(parse_time(trip["departure_time"]))
+            itinerary_ids.append(trip["itinerary_id"])
+            timing_lists.append(trip["timing_list"])
+            self.route_jkeys.append(trip["route_jkey"])
+
+        self.trip_rows = numpy.array(rows, numpy.int64)
+        self.starts = numpy.array(starts, numpy.int64)
+        self.itinerary_ids = numpy.array(itinerary_ids, numpy.int64)
+        self.timing_ptr = numpy.zeros(len(rows) + 1, numpy.int64)
+        numpy.cumsum([len(timing) for timing in timing_lists], out=self.timing_ptr[1:])
+        self.timings = numpy.fromiter((offset for timing in timing_lists for offset in timing), numpy.int64, self.timing_ptr[-1])
+        self.ends = self.starts + numpy.array([max(timing, default=0) for timing in timing_lists], numpy.int64)
+
+        # trips by service, then duration class, then departure
+        durations = numpy.clip(self.ends - self.starts, 0, None)
+        duration_classes = numpy.frexp(durations.astype(numpy.float64))[1].astype(numpy.int64)
+        num_classes = int(duration_classes.max(initial=0)) + 1
+        groups = numpy.array(slots, numpy.int64) * num_classes + duration_classes
+        num_groups = len(self.service_slots) * num_classes
+        self.by_start = numpy.lexsort((self.starts, groups))
+        self.sorted_starts = self.starts[self.by_start]
+        self.group_ptr = numpy.searchsorted(groups[self.by_start], numpy.arange(num_groups + 1))
+        self.longest = numpy.zeros(num_groups, numpy.int64)
+        numpy.maximum.at(self.longest, groups, durations)
+        # the groups of each service holding any trip
+        counts = numpy.diff(self.group_ptr).reshape(-1, num_classes)
+        self.service_groups = [(slot * num_classes + numpy.flatnonzero(counts[slot])).tolist() for slot in range(len(counts))]
+
+        # a trip's offsets made non-decreasing and tagged with the trip, so one
+        # binary search finds the last stop every trip has reached
+        trip_of_timing = numpy.repeat(numpy.arange(len(rows), dtype=numpy.int64), numpy.diff(self.timing_ptr))
+        self.reach_keys = numpy.maximum.accumulate((trip_of_timing << 32) | numpy.clip(self.timings, 0, None))
+
+        stop_lists = [json.loads(bytes(itineraries_table.get(i)))["stop_list"] for i in range(len(itineraries_table))]
+        self.stop_ptr = numpy.zeros(len(stop_lists) + 1, numpy.int64)
+        numpy.cumsum([len(stop_list) for stop_list in stop_lists], out=self.stop_ptr[1:])
+        coordinates = [(lat, lon) for stop_list in stop_lists for _, lat, lon in stop_list]
+        self.stop_coordinates = numpy.array(coordinates, numpy.float64).reshape(-1, 2)
+        # the last stop of a trip that has both coordinates and a time
+        self.last_index = numpy.minimum(numpy.diff(self.stop_ptr)[self.itinerary_ids], numpy.diff(self.timing_ptr)) - 1
+
+    def nbytes(self):
+        arrays = [self.trip_rows, self.starts, self.ends, self.itinerary_ids, self.timing_ptr, self.timings,
+                  self.by_start, self.sorted_starts, self.group_ptr, self.longest, self.reach_keys,
+                  self.stop_ptr, self.stop_coordinates, self.last_index]
+        return sum(array.nbytes for array in arrays) + len(self.route_jkeys) * 8
+
+    # trips of a service running at seconds into its service day
+    def running(self, service_jkey, seconds):
+        slot = self.service_slots.get(service_jkey)
+        if slot is None:
+            return numpy.zeros(0, numpy.int64)
+        candidates = []
+        for group in self.service_groups[slot]:
+            lo, hi = self.group_ptr[group], self.group_ptr[group + 1]
+            first = lo + numpy.searchsorted(self.sorted_starts[lo:hi], seconds - self.longest[group], "left")
+            last = lo + numpy.searchsorted(self.sorted_starts[lo:hi], seconds, "right")
+            candidates.append(self.by_start[first:last])
+        trips = numpy.concatenate(candidates) if candidates else numpy.zeros(0, numpy.int64)
+        return trips[self.ends[trips] >= seconds]
+
+    # trips running on date at seconds after midnight, and how far into their
+    # service day that is for each
+    def at(self, service_by_date, date, seconds):
+        found, service_seconds = [], []
+        previous_date = format_date(parse_date(date) - 1)
+        for day, offset in [(date, 0), (previous_date, day_seconds)]:
+            for service_jkey in service_by_date.active(day):
+                trips = self.running(service_jkey, seconds + offset)
+                found.append(trips)
+                service_seconds.append(numpy.full(len(trips), seconds + offset, numpy.int64))
+        if not found:
+            return numpy.zeros(0, numpy.int64), numpy.zeros(0, numpy.int64)
+        trips, service_seconds = numpy.concatenate(found), numpy.concatenate(service_seconds)
+        order = numpy.argsort(trips, kind="stable")
+        return trips[order], service_seconds[order]
+
+    # how many seconds each trip has run, and the index of the last stop it reached
+    def progress(self, trips, service_seconds):
+        reached = numpy.clip(service_seconds - self.starts[trips], 0, None)
+        found = numpy.searchsorted(self.reach_keys, (trips << 32) | reached.astype(numpy.int64), "right") - 1
+        return reached, numpy.minimum(numpy.clip(found - self.timing_ptr[trips], 0, None), self.last_index[trips])
+
+    # (stop index, [lat, lon]) of the last stop each trip has reached
+    def last_stops(self, trips, service_seconds):
+        _, stop_index = self.progress(trips, service_seconds)
+        return stop_index, self.stop_coordinates[self.stop_ptr[self.itinerary_ids[trips]] + stop_index]
+
+    # [lat, lon] of each trip, on the straight line from the last stop it
+    # reached to the next, as far along as its time between them
+    def positions(self, trips, service_seconds):
+        reached, stop_index = self.progress(trips, service_seconds)
+        next_index = numpy.minimum(stop_index + 1, self.last_index[trips])
+
+        timing_start = self.timing_ptr[trips]
+        left, right = self.timings[timing_start + stop_index], self.timings[timing_start + next_index]
+        span = right - left
+        fraction = numpy.clip((reached - left) / numpy.maximum(span, 1), 0, 1) * (span > 0)
+
+        first_stop = self.stop_ptr[self.itinerary_ids[trips]]
+        origin = self.stop_coordinates[first_stop + stop_index]
+        return origin + (self.stop_coordinates[first_stop + next_index] - origin) * fraction[:, None]
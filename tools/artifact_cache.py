@@ -0,0 +1,136 @@
+import hashlib
+import json
+import os
+import shutil
+from . import payload_tables
+from .service_calendar import ServiceCalendar
+from .id_registry import registry as ids
+
+# bump whenever the converters or libvis change what they produce
+converter_version = "8"
+
+gtfs_files = [
+    "calendar.txt",
+    "calendar_dates.txt",
+    "routes.txt",
+    "shapes.txt",
+    "stops.txt",
+    "trips.txt",
+    "stop_times.txt",
+]
+
+# layout of one cache entry:
+#   <cache_dir>/<fingerprint>/visualizefiles/   copy of the generated .visualizefiles
+#   <cache_dir>/<fingerprint>/calendar.npz      the ServiceCalendar
+#   <cache_dir>/<fingerprint>/ids.json          interned ids and their jkeys
+#   <cache_dir>/<fingerprint>/tables.npz        the feed's serving tables (payload_tables.py)
+# <cache_dir>/content_hashes.json remembers the hash of every input file by
+# (path, size, mtime) so an untouched feed is not re-read to be fingerprinted
+
+
+def content_hash(source, name):
+    digest = hashlib.sha256()
+    with source.open(name, binary=True) as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+# content hash of every GTFS file in source (gtfs_source.py), by file name
+def file_hashes(source, cache_dir):
+    hashes_path = os.path.join(cache_dir, "content_hashes.json")
+    try:
+        with open(hashes_path, "r") as f:
+            known_hashes = json.load(f)
+    except (OSError, ValueError):
+        known_hashes = {}
+
+    # hashes of other feeds' files are kept, stale ones for this feed's files dropped
+    paths = {source.member_path(name) for name in gtfs_files}
+    new_hashes = {key: value for key, value in known_hashes.items() if key.rpartition(":")[0].rpartition(":")[0] not in paths}
+    hashes = {}
+    for name, (size, mtime) in source.stats(gtfs_files).items():
+        stat_key = "%s:%d:%d" % (source.member_path(name), size, mtime)
+        file_hash = known_hashes.get(stat_key) or content_hash(source, name)
+        new_hashes[stat_key] = file_hash
+        hashes[name] = file_hash
+
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = "%s.%d.tmp" % (hashes_path, os.getpid())
+    with open(tmp_path, "w") as f:
+        json.dump(new_hashes, f)
+    os.replace(tmp_path, hashes_path)
+
+    return hashes
+
+
+def fingerprint(source, cache_dir, hashes=None):
+    if hashes is None:
+        hashes = file_hashes(source, cache_dir)
+    digest = hashlib.sha256(converter_version.encode())
+    for name, file_hash in hashes.items():
+        digest.update(("%s:%s\n" % (name, file_hash)).encode())
+    return digest.hexdigest()
+
+
+# (service_by_date, tables) of a cached feed, with its ids loaded into the
+# registry, or None. for a feed whose generated files are already in place
+def load_tables(cache_dir, key):
+    entry_dir = os.path.join(cache_dir, key)
+    if not os.path.isdir(entry_dir):
+        return None
+
+    try:
+        tables = payload_tables.load(os.path.join(entry_dir, "tables.npz"))
+    except (OSError, ValueError, KeyError):
+        print("Cached tables in %s are unreadable. Regenerating vis files." % entry_dir)
+        return None
+
+    service_by_date = ServiceCalendar.load(os.path.join(entry_dir, "calendar.npz"))
+    ids.load(os.path.join(entry_dir, "ids.json"))
+    os.utime(entry_dir)
+    return service_by_date, tables
+
+
+# (service_by_date, tables) of a cached feed, its generated files copied into out_dir, or None
+def load(cache_dir, key, out_dir):
+    cached = load_tables(cache_dir, key)
+    if cached is not None:
+        shutil.copytree(os.path.join(cache_dir, key, "visualizefiles"), out_dir, dirs_exist_ok=True)
+    return cached
+
+
+def store(cache_dir, key, out_dir, service_by_date, tables, keep=3):
+    entry_dir = os.path.join(cache_dir, key)
+    tmp_dir = "%s.%d.tmp" % (entry_dir, os.getpid())
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    shutil.copytree(out_dir, os.path.join(tmp_dir, "visualizefiles"))
+    service_by_date.save(os.path.join(tmp_dir, "calendar.npz"))
+    ids.save(os.path.join(tmp_dir, "ids.json"))
+    try:
+        payload_tables.save(tables, os.path.join(tmp_dir, "tables.npz"))
+    except OSError as e:
+        print("Could not save the feed's tables (%s). Feed will not be cached." % e)
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        return
+
+    shutil.rmtree(entry_dir, ignore_errors=True)
+    try:
+        os.rename(tmp_dir, entry_dir)
+    except OSError:
+        # another process stored the same feed first
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    prune(cache_dir, keep)
+
+
+def prune(cache_dir, keep):
+    entries = []
+    for name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, name)
+        if os.path.isdir(path) and not name.endswith(".tmp"):
+            entries.append((os.path.getmtime(path), path))
+
+    entries.sort(reverse=True)
+    for _, path in entries[keep:]:
+        shutil.rmtree(path, ignore_errors=True)
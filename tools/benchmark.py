@@ -0,0 +1,331 @@
+import argparse
+import http.client
+import json
+import logging
+import os
+import platform
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import threading
+import time
+import traceback
+
+from werkzeug.serving import make_server
+
+import visualize
+from .artifact_cache import converter_version, gtfs_files
+from .id_registry import registry as ids
+from . import payload_tables
+from . import shape_store
+from .feeds import Feed
+from .gtfs_source import open_source
+from .csv_columns import ColumnReader
+
+# Benchmarks a GTFS feed end to end and writes the results as JSON:
+#   stages     every conversion stage run alone in a forked child, after the
+#              stages it takes inputs from (setup_stages, not timed): wall time,
+#              peak RSS (setup included) and bytes written to .visualizefiles
+#   pipeline   the real concurrent pipeline: per-stage and total wall time
+#   endpoints  latency percentiles and throughput of every Flask endpoint,
+#              hit over HTTP by concurrent clients against a live server. a
+#              vehicle stream request reads its first stream_events events, with
+#              the tick shortened to stream_tick_seconds, so it times building
+#              frames rather than waiting between them
+# Run it from the repository root, like visualize.py.
+
+out_dir = ".visualizefiles"
+
+stream_events = 10
+stream_tick_seconds = 0.001
+# trips in one sampled batch request, about a route's worth
+batch_trips = 100
+
+
+def maxrss_bytes(usage):
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return usage.ru_maxrss if sys.platform == "darwin" else usage.ru_maxrss * 1024
+
+
+def dir_bytes(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            total += os.path.getsize(os.path.join(root, name))
+    return total
+
+
+def reset_out_dir():
+    shutil.rmtree(out_dir, ignore_errors=True)
+    os.makedirs(os.path.join(out_dir, "routes"))
+
+
+def feed_stats(source):
+    stats = {}
+    for name, (size, _) in source.stats(gtfs_files).items():
+        with source.open(name, binary=True) as f:
+            rows = sum(block.count(b"\n") for block in iter(lambda: f.read(1 << 20), b"")) - 1
+        stats[name] = {"rows": rows, "bytes": size}
+    return stats
+
+
+def run_isolated(stage, values):
+    reset_out_dir()
+    setup = visualize.pipeline.upstream([stage.name])
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            os.close(read_fd)
+            if setup:
+                values, _ = visualize.pipeline.run(values, only=setup)
+            bytes_before = dir_bytes(out_dir)
+            started = time.perf_counter()
+            stage.run(values)
+            report = {"seconds": time.perf_counter() - started, "bytes_before": bytes_before}
+            os.write(write_fd, json.dumps(report).encode())
+            os._exit(0)
+        except BaseException:
+            traceback.print_exc()
+            os._exit(1)
+
+    os.close(write_fd)
+    with os.fdopen(read_fd) as f:
+        report = f.read()
+    _, status, usage = os.wait4(pid, 0)
+    ok = os.WIFEXITED(status) and os.WEXITSTATUS(status) == 0
+    report = json.loads(report) if ok else {}
+    return {
+        "seconds": report.get("seconds"),
+        "peak_rss_bytes": maxrss_bytes(usage),
+        "bytes_written": dir_bytes(out_dir) - report.get("bytes_before", 0),
+        "setup_stages": [setup_stage.name for setup_stage in visualize.pipeline.stages if setup_stage.name in setup],
+        "ok": ok,
+    }
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    return sorted_values[min(int(fraction * len(sorted_values)), len(sorted_values) - 1)]
+
+
+# (method, path, body, events) of a request in endpoint_paths: a path alone is a
+# GET. events: how many server-sent events to read before hanging up, or None
+# to read the whole response
+def request_spec(request):
+    if isinstance(request, str):
+        return "GET", request, None, None
+    return request
+
+
+def read_events(resp, events):
+    body = []
+    while events:
+        line = resp.readline()
+        if not line:
+            break
+        body.append(line)
+        if line == b"\n":
+            events -= 1
+    return b"".join(body)
+
+
+def load_endpoint(port, paths, requests, concurrency):
+    latencies = []
+    errors = [0]
+    response_bytes = [0]
+    lock = threading.Lock()
+
+    def client(count, rng):
+        mine = []
+        for _ in range(count):
+            method, path, payload, events = request_spec(rng.choice(paths))
+            started = time.perf_counter()
+            try:
+                conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+                headers = {} if payload is None else {"Content-Type": "application/json"}
+                conn.request(method, path, payload, headers)
+                resp = conn.getresponse()
+                body = resp.read() if events is None else read_events(resp, events)
+                conn.close()
+                ok = resp.status == 200
+            except OSError:
+                ok, body = False, b""
+            mine.append(time.perf_counter() - started)
+            with lock:
+                response_bytes[0] += len(body)
+                if not ok:
+                    errors[0] += 1
+        with lock:
+            latencies.extend(mine)
+
+    per_client = max(requests // concurrency, 1)
+    threads = [threading.Thread(target=client, args=(per_client, random.Random(i))) for i in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    ms = lambda seconds: None if seconds is None else round(seconds * 1000, 3)
+    return {
+        "requests": len(latencies),
+        "errors": errors[0],
+        "mean_ms": ms(sum(latencies) / len(latencies)) if latencies else None,
+        "p50_ms": ms(percentile(latencies, 0.50)),
+        "p90_ms": ms(percentile(latencies, 0.90)),
+        "p99_ms": ms(percentile(latencies, 0.99)),
+        "max_ms": ms(latencies[-1]) if latencies else None,
+        "requests_per_second": round(len(latencies) / elapsed, 1) if elapsed else None,
+        "mean_response_bytes": response_bytes[0] // max(len(latencies), 1),
+    }
+
+
+def endpoint_paths(source, service_by_date, sample=200, seed=0):
+    rng = random.Random(seed)
+    with source.open("trips.txt") as f:
+        trip_ids = [trip_id for trip_id, in ColumnReader(f, ["trip_id"], required=["trip_id"]).rows()]
+
+    trips = visualize.feed.tables["trips"]
+    all_trip_rows = [i for i in range(len(trip_ids)) if trips.get(i)]
+    trip_rows = rng.sample(all_trip_rows, min(sample, len(all_trip_rows)))
+    itinerary_ids = sorted({json.loads(bytes(trips.get(i)))["itinerary_id"] for i in trip_rows})
+
+    with source.open("stops.txt") as f:
+        stop_coordinates = []
+        for lat, lon in ColumnReader(f, ["stop_lat", "stop_lon"], required=["stop_lat", "stop_lon"]).rows():
+            try:
+                stop_coordinates.append((float(lat), float(lon)))
+            except ValueError:
+                continue
+    stop_coordinates = stop_coordinates or [(0.0, 0.0)]
+
+    dates = list(service_by_date.active_between("00010101", "99991231")) or ["19700101"]
+    route_jkeys = ids.routes.jkeys or ["none"]
+    shape_jkeys = ids.shapes.jkeys
+
+    paths = {
+        "home": ["/"],
+        "static_js": ["/js/visualizer.js", "/js/tools.js"],
+        "stops": ["/.visualizefiles/stops/stops.json"],
+        "trip": ["/.visualizefiles/trips/%d.json" % i for i in trip_rows],
+        "itinerary": ["/.visualizefiles/itineraries/x/itin_%d.json" % i for i in itinerary_ids],
+        "trip_index": ["/.visualizefiles/trip_index/%s.json" % trip_id for trip_id in rng.sample(trip_ids, min(sample, len(trip_ids)))],
+        "trips_by_date": [
+            "/.visualizefiles/trips_by_date/%s/%s.json" % (rng.choice(dates), rng.choice(route_jkeys)) for _ in range(sample)
+        ],
+        "active_trips": [
+            "/.visualizefiles/active_trips.json?date=%s&time=%02d:%02d:00" % (rng.choice(dates), rng.randrange(24), rng.randrange(60))
+            for _ in range(sample)
+        ],
+        "vehicles": [
+            "/.visualizefiles/vehicles.json?date=%s&time=%02d:%02d:00" % (rng.choice(dates), rng.randrange(24), rng.randrange(60))
+            for _ in range(sample)
+        ],
+        "vehicle_stream": [
+            ("GET", "/.visualizefiles/vehicles/stream?date=%s&time=%02d:%02d:00&speed=1000"
+             % (rng.choice(dates), rng.randrange(24), rng.randrange(60)), None, stream_events)
+            for _ in range(sample)
+        ],
+        "stops_bbox": [],
+        "batch": [],
+        "cache_stats": ["/cache_stats"],
+    }
+    # boxes around stops, from a few blocks to a city, at the zoom a map showing them has
+    for _ in range(sample):
+        lat, lon = rng.choice(stop_coordinates)
+        size, zoom = rng.choice([(0.005, 15.5), (0.02, 14), (0.08, 12.25)])
+        paths["stops_bbox"].append(
+            "/.visualizefiles/stops/bbox.json?bbox=%f,%f,%f,%f&zoom=%g" % (lon - size, lat - size, lon + size, lat + size, zoom)
+        )
+    # the trips of a route and their itineraries, as the page asks for them
+    for _ in range(sample):
+        batch = rng.sample(all_trip_rows, min(batch_trips, len(all_trip_rows)))
+        batch_itineraries = sorted({json.loads(bytes(trips.get(i)))["itinerary_id"] for i in batch})
+        body = json.dumps({"trips": batch, "itineraries": batch_itineraries})
+        paths["batch"].append(("POST", "/.visualizefiles/batch", body, None))
+    if shape_jkeys:
+        paths["shape"] = ["/.visualizefiles/shapes/%s.json" % jkey for jkey in rng.sample(shape_jkeys, min(sample, len(shape_jkeys)))]
+    return paths
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(source, requests=2000, concurrency=8, isolated=True):
+    results = {
+        "benchmark_version": 1,
+        "git_revision": git_revision(),
+        "converter_version": converter_version,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "feed": feed_stats(source),
+    }
+
+    values = {"source": source, "out_dir": out_dir}
+    if isolated:
+        results["stages"] = {stage.name: run_isolated(stage, values) for stage in visualize.pipeline.stages}
+
+    reset_out_dir()
+    values, timings = visualize.pipeline.run(values)
+    service_by_date = values["service_by_date"]
+    visualize.feed = Feed(
+        "",
+        "benchmark",
+        out_dir,
+        service_by_date,
+        ids,
+        shape_store.ShapeStore.open(os.path.join(out_dir, "shapes")),
+        payload_tables.take(visualize.libvis),
+    )
+    results["pipeline"] = {
+        "seconds": timings,
+        "peak_rss_bytes": maxrss_bytes(resource.getrusage(resource.RUSAGE_SELF)),
+        "bytes_written": dir_bytes(out_dir),
+    }
+
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    visualize.vehicle_tick_seconds = stream_tick_seconds
+    server = make_server("127.0.0.1", 0, visualize.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        results["endpoints"] = {
+            name: load_endpoint(server.server_port, paths, requests, concurrency)
+            for name, paths in endpoint_paths(source, service_by_date).items()
+        }
+    finally:
+        server.shutdown()
+
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark conversion and serving of a GTFS feed.")
+    parser.add_argument("gtfs_dir", help="directory or .zip of GTFS files")
+    parser.add_argument("--out", help="write the JSON results here instead of stdout")
+    parser.add_argument("--requests", type=int, default=2000, help="requests per endpoint")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--no-isolated", action="store_true", help="skip timing each stage alone")
+    args = parser.parse_args()
+
+    source = open_source(args.gtfs_dir)
+    if source is None:
+        print("Error: %s is neither a directory nor a zip file" % args.gtfs_dir)
+        exit(1)
+    results = run(source, args.requests, args.concurrency, not args.no_isolated)
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
@@ -0,0 +1,113 @@
+import gzip
+import os
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from . import metrics
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Generated files get .gz (and, when the brotli package is installed, .br)
+# siblings at conversion time; the server picks one by Accept-Encoding.
+
+min_size = 1024
+compressible = (".json", ".js", ".html")
+
+
+def encodings():
+    return ["br", "gzip"] if brotli is not None else ["gzip"]
+
+
+def suffix(encoding):
+    return {"br": ".br", "gzip": ".gz"}[encoding]
+
+
+# best is for files compressed once at conversion time; responses compressed
+# while serving use cheaper settings
+def compress(data, encoding, best=True):
+    if encoding == "br":
+        return brotli.compress(data, quality=11 if best else 5)
+    return gzip.compress(data, compresslevel=9 if best else 6, mtime=0)
+
+
+# for streamed responses: compresses chunks as they are produced
+def compress_stream(chunks, encoding):
+    if encoding == "br":
+        compressor = brotli.Compressor(quality=5)
+        for chunk in chunks:
+            yield compressor.process(chunk)
+        yield compressor.finish()
+    else:
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+        for chunk in chunks:
+            yield compressor.compress(chunk)
+        yield compressor.flush()
+
+
+def negotiate(accept_encoding):
+    accepted = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[name.strip().lower()] = q
+
+    best = None
+    for encoding in encodings():
+        q = accepted.get(encoding, accepted.get("*", 0.0))
+        if q > 0 and (best is None or q > best[1]):
+            best = (encoding, q)
+    return best[0] if best else None
+
+
+def precompress_file(path):
+    with open(path, "rb") as f:
+        data = f.read()
+    written = 0
+    for encoding in encodings():
+        compressed = compress(data, encoding)
+        if len(compressed) < len(data):
+            # replaced rather than rewritten: the old variant may be hardlinked into a live tree
+            tmp_path = "%s%s.%d.tmp" % (path, suffix(encoding), os.getpid())
+            with open(tmp_path, "wb") as out:
+                out.write(compressed)
+            os.replace(tmp_path, path + suffix(encoding))
+            written += len(compressed)
+    return written
+
+
+# variants at least as new as their file were left by an earlier run over the same tree
+def up_to_date(path):
+    mtime = os.path.getmtime(path)
+    variants = [path + suffix(encoding) for encoding in encodings()]
+    return all(os.path.isfile(variant) and os.path.getmtime(variant) >= mtime for variant in variants)
+
+
+@metrics.stage("precompress")
+def precompress_tree(root, threads=None):
+    paths = []
+    for dirpath, _, files in os.walk(root):
+        for name in files:
+            path = os.path.join(dirpath, name)
+            if name.endswith(compressible) and os.path.getsize(path) >= min_size and not up_to_date(path):
+                paths.append(path)
+
+    # zlib and brotli release the GIL while compressing
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        written = sum(pool.map(precompress_file, paths))
+    metrics.add("precompress", rows=len(paths), bytes=written)
+    return written
+
+
+def variant(path, accept_encoding):
+    encoding = negotiate(accept_encoding)
+    if encoding is not None and os.path.isfile(path + suffix(encoding)):
+        return path + suffix(encoding), encoding
+    return path, None
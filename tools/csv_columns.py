@@ -0,0 +1,69 @@
+import csv
+import itertools
+import operator
+
+# Reads a GTFS csv file by column instead of as one dict per row: the header is
+# resolved once, then every row is cut down to the wanted columns by a single
+# itemgetter call and handed out as a tuple, a chunk of rows at a time.
+# Wanted columns missing from the header are left out of the tuples; columns
+# lists the ones present, in the order asked for. Rows shorter than the header
+# are padded with None, and blank lines skipped, as csv.DictReader does.
+
+
+class MissingColumns(ValueError):
+    def __init__(self, columns):
+        super().__init__("missing columns: %s" % ", ".join(columns))
+        self.columns = columns
+
+
+class ColumnReader:
+    # required: wanted columns the file must have, or MissingColumns is raised
+    def __init__(self, f, wanted, required=()):
+        self.reader = csv.reader(f, skipinitialspace=True)
+        header = next(self.reader, [])
+        # like csv.DictReader, the last of two columns with the same name wins
+        index = {name: i for i, name in enumerate(header)}
+
+        missing = [name for name in required if name not in index]
+        if missing:
+            raise MissingColumns(missing)
+
+        self.columns = [name for name in wanted if name in index]
+        self.width = len(header)
+        indices = [index[name] for name in self.columns]
+        if len(indices) == 1:
+            only = indices[0]
+            self.project = lambda row: (row[only],)
+        elif indices:
+            self.project = operator.itemgetter(*indices)
+        else:
+            self.project = lambda row: ()
+
+    def has(self, name):
+        return name in self.columns
+
+    @property
+    def line_num(self):
+        return self.reader.line_num
+
+    def pad(self, row):
+        return self.project(row + [None] * (self.width - len(row)))
+
+    def chunks(self, chunk_rows=1 << 16):
+        while True:
+            rows = [row for row in itertools.islice(self.reader, chunk_rows) if row]
+            if not rows:
+                return
+            try:
+                yield list(map(self.project, rows))
+            except IndexError:
+                yield [self.pad(row) if len(row) < self.width else self.project(row) for row in rows]
+
+    def rows(self, chunk_rows=1 << 16):
+        for chunk in self.chunks(chunk_rows):
+            yield from chunk
+
+    # a chunk as one tuple per column, e.g. to build numpy arrays from
+    @staticmethod
+    def columnar(chunk):
+        return list(zip(*chunk))
@@ -0,0 +1,70 @@
+import os
+import numpy
+
+# Sorts more records than fit in memory. Records come in as numpy record
+# arrays and are sorted in runs of about run_rows, each spilled to a file; the
+# runs are then merged back a block of each at a time. merge hands out the
+# records in batches that never split a group (records sharing the first sort
+# key), so a caller can process groups whole while only a block of every run
+# is in memory. Sorts are stable and runs merge in the order they were
+# spilled, so records with equal keys keep the order they came in.
+
+
+def sort_records(records, keys):
+    return records[numpy.lexsort([records[key] for key in reversed(keys)])]
+
+
+def spill(batches, keys, spill_dir, run_rows):
+    runs = []
+    pending = []
+    pending_rows = 0
+
+    def write_run():
+        path = os.path.join(spill_dir, "run-%d" % len(runs))
+        sort_records(numpy.concatenate(pending), keys).tofile(path)
+        runs.append(path)
+        pending.clear()
+
+    for batch in batches:
+        pending.append(batch)
+        pending_rows += len(batch)
+        if pending_rows >= run_rows:
+            write_run()
+            pending_rows = 0
+    if pending_rows:
+        write_run()
+    return runs
+
+
+def merge(runs, dtype, keys, block_rows):
+    group = keys[0]
+    files = [open(path, "rb") for path in runs]
+    try:
+        blocks = [numpy.fromfile(f, dtype, block_rows) for f in files]
+        done = [len(block) < block_rows for block in blocks]
+        while True:
+            # a run still being read may hold more of the group its block ends
+            # in, but none of any group before it
+            reading = [i for i in range(len(runs)) if not done[i]]
+            bound = min(blocks[i][group][-1] for i in reading) if reading else None
+
+            parts = []
+            for i, block in enumerate(blocks):
+                cut = len(block) if bound is None else numpy.searchsorted(block[group], bound)
+                parts.append(block[:cut])
+                blocks[i] = block[cut:]
+            batch = numpy.concatenate(parts) if parts else numpy.zeros(0, dtype)
+            if len(batch):
+                yield sort_records(batch, keys)
+            if bound is None:
+                return
+
+            # read on in the runs that are used up or end in the bounding group
+            for i in reading:
+                if not len(blocks[i]) or blocks[i][group][-1] == bound:
+                    more = numpy.fromfile(files[i], dtype, block_rows)
+                    done[i] = len(more) < block_rows
+                    blocks[i] = numpy.concatenate((blocks[i], more))
+    finally:
+        for f in files:
+            f.close()
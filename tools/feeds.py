@@ -0,0 +1,80 @@
+import os
+import re
+import threading
+from .active_trips import ActiveTrips
+from .artifact_cache import gtfs_files
+from .gtfs_source import open_source
+from .id_registry import kinds
+
+# One loaded GTFS feed: everything the server needs to answer its requests.
+# With several feeds, each one's libvis tables are exported into memory python
+# owns and its id registry is copied, so libvis and the process-wide registry are
+# free to load the next feed. nbytes is an estimate of the memory a feed holds;
+# its shapes are memory-mapped and live in the page cache, so they do not count.
+# The index of running trips is built from the tables when first asked for.
+
+name_pattern = re.compile(r"^[A-Za-z0-9_.-]+$")
+
+# dict entry, key string and row number of one interned id or keyed table row
+per_key_bytes = 120
+
+
+class Feed:
+    def __init__(self, name, cache_key, out_dir, service_by_date, ids, shapes, tables):
+        self.name = name
+        self.cache_key = cache_key
+        self.out_dir = out_dir
+        self.service_by_date = service_by_date
+        self.ids = ids
+        self.shapes = shapes
+        self.tables = tables
+        self.active = None
+        self.active_lock = threading.Lock()
+
+    def active_trips(self):
+        with self.active_lock:
+            if self.active is None:
+                self.active = ActiveTrips(self.tables["trips"], self.tables["itineraries"])
+            return self.active
+
+    # a route's trips by hour for each service running on date, as served at
+    # trips_by_date/<date>/<route_jkey>.json
+    def trips_on_date(self, date, route_jkey):
+        results = []
+        for service_jkey in self.service_by_date.active(date):
+            result = self.tables["trips_by_hour"].lookup((route_jkey, service_jkey))
+            if result:
+                results.append(result)
+        return b"[%b]" % b", ".join(results)
+
+    def nbytes(self):
+        size = sum(table.nbytes() for table in self.tables.values())
+        size += self.service_by_date.day_ptr.nbytes + self.service_by_date.service_index.nbytes
+        keys = sum(len(getattr(self.ids, kind)) for kind in kinds)
+        keys += sum(len(table.row_by_key) for table in self.tables.values() if table.row_by_key is not None)
+        if self.shapes is not None:
+            keys += len(self.shapes.row_by_jkey)
+        if self.active is not None:
+            size += self.active.nbytes()
+        return size + keys * per_key_bytes
+
+
+# every subdirectory or .zip in feeds_root holding GTFS files is a feed, named
+# after it. returns the gtfs_source of each feed by name
+def discover(feeds_root):
+    sources = {}
+    for entry in sorted(os.listdir(feeds_root)):
+        path = os.path.join(feeds_root, entry)
+        name = entry[:-len(".zip")] if entry.endswith(".zip") else entry
+        source = open_source(path) if os.path.isdir(path) or entry.endswith(".zip") else None
+        if source is None:
+            continue
+        if not name_pattern.match(name):
+            print("Skipping feed %s: feed names may only use letters, digits, '.', '_' and '-'" % path)
+            continue
+        if name in sources:
+            print("Skipping feed %s: there is another feed named %s" % (path, name))
+            continue
+        if any(source.exists(gtfs_file) for gtfs_file in gtfs_files):
+            sources[name] = source
+    return sources
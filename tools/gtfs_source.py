@@ -0,0 +1,111 @@
+import contextlib
+import io
+import os
+import shutil
+import tempfile
+import zipfile
+
+# Where a feed's GTFS files are read from: a directory of .txt files, or a .zip
+# of them. Converters stream each file through open(), straight out of the
+# archive for a zip. libvis reads files by path, so native_dir decompresses the
+# files it needs into shared memory (/dev/shm) for as long as it reads them.
+# A zip may keep its files in a subdirectory; the shallowest copy of each is used.
+
+shared_memory_dir = "/dev/shm"
+
+
+def open_source(path):
+    if os.path.isdir(path):
+        return DirectorySource(path)
+    if zipfile.is_zipfile(path):
+        return ZipSource(path)
+    return None
+
+
+class DirectorySource:
+    def __init__(self, path):
+        self.path = path
+
+    def __str__(self):
+        return self.path
+
+    def exists(self, name):
+        return os.path.isfile(os.path.join(self.path, name))
+
+    def open(self, name, binary=False):
+        if binary:
+            return open(os.path.join(self.path, name), "rb")
+        return open(os.path.join(self.path, name), "r", encoding="utf-8-sig")
+
+    # where a file lives, for telling apart the files of different feeds
+    def member_path(self, name):
+        return os.path.abspath(os.path.join(self.path, name))
+
+    # (size, mtime in ns) of each of names that exists
+    def stats(self, names):
+        stats = {}
+        for name in names:
+            try:
+                stat = os.stat(os.path.join(self.path, name))
+            except FileNotFoundError:
+                continue
+            stats[name] = (stat.st_size, stat.st_mtime_ns)
+        return stats
+
+    @contextlib.contextmanager
+    def native_dir(self, names):
+        yield self.path
+
+
+class ZipSource:
+    def __init__(self, path):
+        self.path = path
+
+    def __str__(self):
+        return self.path
+
+    # the archive is reopened per call: it may be replaced while a feed is watched
+    @staticmethod
+    def members(archive):
+        members = {}
+        for info in sorted(archive.infolist(), key=lambda info: info.filename.count("/")):
+            name = info.filename.rpartition("/")[2]
+            if not info.is_dir() and name not in members:
+                members[name] = info
+        return members
+
+    def exists(self, name):
+        with zipfile.ZipFile(self.path) as archive:
+            return name in self.members(archive)
+
+    def open(self, name, binary=False):
+        with zipfile.ZipFile(self.path) as archive:
+            # the member keeps the archive's file open after the archive is closed
+            member = archive.open(self.members(archive)[name])
+        if binary:
+            return member
+        return io.TextIOWrapper(member, encoding="utf-8-sig")
+
+    def member_path(self, name):
+        return "%s!%s" % (os.path.abspath(self.path), name)
+
+    def stats(self, names):
+        mtime = os.stat(self.path).st_mtime_ns
+        with zipfile.ZipFile(self.path) as archive:
+            members = self.members(archive)
+        return {name: (members[name].file_size, mtime) for name in names if name in members}
+
+    @contextlib.contextmanager
+    def native_dir(self, names):
+        root = shared_memory_dir if os.path.isdir(shared_memory_dir) else None
+        out_dir = tempfile.mkdtemp(prefix="viz-gtfs-", dir=root)
+        try:
+            with zipfile.ZipFile(self.path) as archive:
+                members = self.members(archive)
+                for name in names:
+                    if name in members:
+                        with archive.open(members[name]) as member, open(os.path.join(out_dir, name), "wb") as out:
+                            shutil.copyfileobj(member, out, 1 << 20)
+            yield out_dir
+        finally:
+            shutil.rmtree(out_dir, ignore_errors=True)
@@ -0,0 +1,83 @@
+import hashlib
+import json
+import threading
+
+# GTFS ids are interned to dense integer codes, one table per kind of id.
+# The public jkey (md5 hex of the id, used in URLs and file names) is computed
+# once when an id is first seen, not once per CSV row that mentions it.
+
+kinds = ["routes", "services", "shapes", "trips"]
+
+
+def id_tojkey(id):
+    return hashlib.md5(id.encode()).hexdigest()
+
+
+class IdTable:
+    def __init__(self, ids=(), jkeys=None):
+        self.ids = list(ids)
+        self.jkeys = list(jkeys) if jkeys is not None else [id_tojkey(id) for id in self.ids]
+        self.codes = {id: code for code, id in enumerate(self.ids)}
+        self.codes_by_jkey = None
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.ids)
+
+    def intern(self, id):
+        code = self.codes.get(id)
+        if code is None:
+            with self.lock:
+                code = self.codes.get(id)
+                if code is None:
+                    code = len(self.ids)
+                    self.ids.append(id)
+                    self.jkeys.append(id_tojkey(id))
+                    self.codes[id] = code
+                    self.codes_by_jkey = None
+        return code
+
+    def lookup(self, id):
+        return self.codes.get(id)
+
+    def jkey(self, code):
+        return self.jkeys[code]
+
+    def jkey_of(self, id):
+        return self.jkeys[self.intern(id)]
+
+    def code_of_jkey(self, jkey):
+        if self.codes_by_jkey is None:
+            self.codes_by_jkey = {jkey: code for code, jkey in enumerate(self.jkeys)}
+        return self.codes_by_jkey.get(jkey)
+
+
+class IdRegistry:
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        for kind in kinds:
+            setattr(self, kind, IdTable())
+
+    def copy(self):
+        registry = IdRegistry()
+        for kind in kinds:
+            table = getattr(self, kind)
+            setattr(registry, kind, IdTable(table.ids, table.jkeys))
+        return registry
+
+    def save(self, path):
+        with open(path, "w") as f:
+            tables = {kind: {"ids": getattr(self, kind).ids, "jkeys": getattr(self, kind).jkeys} for kind in kinds}
+            json.dump(tables, f)
+
+    def load(self, path):
+        with open(path, "r") as f:
+            tables = json.load(f)
+        for kind in kinds:
+            table = tables.get(kind, {"ids": [], "jkeys": []})
+            setattr(self, kind, IdTable(table["ids"], table["jkeys"]))
+
+
+registry = IdRegistry()
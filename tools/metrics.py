@@ -0,0 +1,200 @@
+import cProfile
+import functools
+import os
+import resource
+import sys
+import threading
+import time
+from flask import Response, g, request
+
+# Stage and request metrics, rendered at /metrics in the Prometheus text format.
+#   VIZ_METRICS=0           turns every hook below into a no-op
+#   VIZ_PROFILE_SLOW_MS=n   profiles requests and keeps the cProfile stats of
+#                           those slower than n ms in VIZ_PROFILE_DIR. only one
+#                           profiler can run at a time, so a request arriving
+#                           while another is profiled is not profiled
+
+enabled = os.environ.get("VIZ_METRICS", "1") != "0"
+profile_slow_ms = float(os.environ.get("VIZ_PROFILE_SLOW_MS", 0))
+profile_dir = os.environ.get("VIZ_PROFILE_DIR", ".visualizeprofiles")
+
+buckets = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0]
+
+lock = threading.Lock()
+profile_lock = threading.Lock()
+stages = {}
+requests = {}
+caches = {}
+
+
+def peak_rss_bytes():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return usage.ru_maxrss if sys.platform == "darwin" else usage.ru_maxrss * 1024
+
+
+def stage_entry(name):
+    if name not in stages:
+        stages[name] = {"seconds": 0.0, "rows": 0, "bytes": 0, "peak_rss_bytes": 0}
+    return stages[name]
+
+
+def stage(name):
+    def decorator(func):
+        if not enabled:
+            return func
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with lock:
+                entry = stage_entry(name)
+                entry["rows"] = entry["bytes"] = 0
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                with lock:
+                    entry["seconds"] = time.perf_counter() - started
+                    entry["peak_rss_bytes"] = peak_rss_bytes()
+
+        return wrapper
+
+    return decorator
+
+
+def add(name, rows=0, bytes=0):
+    if not enabled:
+        return
+    with lock:
+        entry = stage_entry(name)
+        entry["rows"] += rows
+        entry["bytes"] += bytes
+
+
+def register_cache(name, cache):
+    caches[name] = cache
+
+
+def before_request():
+    g.metrics_started = time.perf_counter()
+    if profile_slow_ms and profile_lock.acquire(blocking=False):
+        g.metrics_profile = cProfile.Profile()
+        try:
+            g.metrics_profile.enable()
+        except ValueError:
+            # another profiler, not started here, is running
+            del g.metrics_profile
+            profile_lock.release()
+
+
+def stop_profile():
+    profile = g.pop("metrics_profile", None)
+    if profile is not None:
+        profile.disable()
+        profile_lock.release()
+    return profile
+
+
+def after_request(resp):
+    elapsed = time.perf_counter() - g.pop("metrics_started", time.perf_counter())
+    endpoint = request.endpoint or "unmatched"
+
+    profile = stop_profile()
+    if profile is not None:
+        if elapsed * 1000 >= profile_slow_ms:
+            os.makedirs(profile_dir, exist_ok=True)
+            path = os.path.join(profile_dir, "%s-%d.prof" % (endpoint, time.time() * 1e6))
+            profile.dump_stats(path)
+            print("Slow request %s took %.1f ms, profile written to %s" % (request.path, elapsed * 1000, path))
+
+    size = resp.content_length or 0
+    with lock:
+        entry = requests.get(endpoint)
+        if entry is None:
+            entry = requests[endpoint] = {"count": {}, "seconds": 0.0, "bytes": 0, "buckets": [0] * len(buckets)}
+        entry["count"][resp.status_code] = entry["count"].get(resp.status_code, 0) + 1
+        entry["seconds"] += elapsed
+        entry["bytes"] += size
+        for i, bound in enumerate(buckets):
+            if elapsed <= bound:
+                entry["buckets"][i] += 1
+                break
+
+    return resp
+
+
+def render():
+    lines = []
+
+    def header(name, kind, help):
+        lines.append("# HELP %s %s" % (name, help))
+        lines.append("# TYPE %s %s" % (name, kind))
+
+    def sample(name, labels, value):
+        label_str = ",".join('%s="%s"' % (k, str(v).replace('"', '\\"')) for k, v in labels)
+        lines.append("%s{%s} %s" % (name, label_str, value) if label_str else "%s %s" % (name, value))
+
+    with lock:
+        stage_items = sorted((name, dict(entry)) for name, entry in stages.items())
+        request_items = sorted(
+            (name, dict(entry, count=dict(entry["count"]), buckets=list(entry["buckets"])))
+            for name, entry in requests.items()
+        )
+
+    for key, help in [
+        ("seconds", "Wall time of the last run of each conversion stage."),
+        ("rows", "Input rows read by the last run of each conversion stage."),
+        ("bytes", "Bytes written by the last run of each conversion stage."),
+        ("peak_rss_bytes", "Process RSS high-water mark when each conversion stage finished."),
+    ]:
+        header("viz_stage_" + key, "gauge", help)
+        for name, entry in stage_items:
+            sample("viz_stage_" + key, [("stage", name)], entry[key])
+
+    header("viz_requests_total", "counter", "Requests served, by endpoint and status.")
+    for name, entry in request_items:
+        for status, count in sorted(entry["count"].items()):
+            sample("viz_requests_total", [("endpoint", name), ("status", status)], count)
+
+    header("viz_response_bytes_total", "counter", "Response body bytes served, by endpoint.")
+    for name, entry in request_items:
+        sample("viz_response_bytes_total", [("endpoint", name)], entry["bytes"])
+
+    header("viz_request_duration_seconds", "histogram", "Time spent handling requests, by endpoint.")
+    for name, entry in request_items:
+        cumulative = 0
+        for bound, count in zip(buckets, entry["buckets"]):
+            cumulative += count
+            sample("viz_request_duration_seconds_bucket", [("endpoint", name), ("le", bound)], cumulative)
+        total = sum(entry["count"].values())
+        sample("viz_request_duration_seconds_bucket", [("endpoint", name), ("le", "+Inf")], total)
+        sample("viz_request_duration_seconds_sum", [("endpoint", name)], entry["seconds"])
+        sample("viz_request_duration_seconds_count", [("endpoint", name)], total)
+
+    cache_stats = sorted((name, cache.stats()) for name, cache in caches.items())
+    for key, kind in [("hits", "counter"), ("misses", "counter"), ("coalesced", "counter"),
+                      ("evictions", "counter"), ("entries", "gauge"), ("bytes", "gauge")]:
+        metric_name = "viz_cache_%s%s" % (key, "_total" if kind == "counter" else "")
+        header(metric_name, kind, "Response cache %s." % key)
+        for name, stats in cache_stats:
+            sample(metric_name, [("cache", name)], stats[key])
+
+    header("viz_process_peak_rss_bytes", "gauge", "Process RSS high-water mark.")
+    sample("viz_process_peak_rss_bytes", [], peak_rss_bytes())
+    return "\n".join(lines) + "\n"
+
+
+def instrument(app):
+    if not enabled:
+        return
+
+    app.before_request(before_request)
+    app.after_request(after_request)
+    # after_request is skipped when a view raises
+    app.teardown_request(lambda exc: stop_profile())
+
+    @app.route("/metrics")
+    def serve_metrics():
+        resp = Response(render(), mimetype="text/plain; version=0.0.4")
+        resp.headers["Cache-Control"] = "no-store"
+        return resp
@@ -0,0 +1,136 @@
+import ctypes
+import numpy
+from .trip_store import TripStore
+
+# Read-only views of the serving tables libvis.export_tables copies into
+# contiguous buffers (backend/src/table_export.h). An entry is a memoryview
+# slice of libvis memory: looking one up neither calls into libvis nor copies.
+# The views are only valid until libvis exports or releases its tables again,
+# unless export is asked to copy the buffers into memory python owns.
+#
+# A feed's server holds the tables take() makes: copies, with trips stored by
+# value in a TripStore, so libvis can release its own. save() and load() keep
+# them in an artifact cache entry as one .npz, keys as utf-8 with offsets.
+
+table_names = ["trips", "itineraries", "trip_index", "trips_by_hour"]
+keyed_tables = {"trip_index", "trips_by_hour"}
+
+
+def declare(libvis):
+    libvis.export_tables.restype = ctypes.c_int
+    pointer = ctypes.POINTER(ctypes.c_void_p)
+    libvis.exported_table.argtypes = [ctypes.c_int, pointer, pointer, pointer, pointer]
+    libvis.exported_table.restype = ctypes.c_uint64
+
+
+def view(address, size):
+    if not size:
+        return memoryview(b"")
+    return memoryview(numpy.ctypeslib.as_array((ctypes.c_uint8 * size).from_address(address)))
+
+
+class PayloadTable:
+    # keys: None for a table indexed by row number
+    def __init__(self, values, offsets, keys=None):
+        self.values = values
+        self.offsets = offsets
+        self.row_by_key = None if keys is None else {key: row for row, key in enumerate(keys)}
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def nbytes(self):
+        return self.values.nbytes + self.offsets.nbytes
+
+    # the same table in memory python owns
+    def copy(self):
+        table = PayloadTable(memoryview(bytes(self.values)), memoryview(bytes(self.offsets)).cast("Q"))
+        table.row_by_key = self.row_by_key
+        return table
+
+    def get(self, row):
+        if not 0 <= row < len(self.offsets) - 1:
+            return None
+        return self.values[self.offsets[row]:self.offsets[row + 1]]
+
+    def lookup(self, key):
+        row = self.row_by_key.get(key)
+        return None if row is None else self.get(row)
+
+    # as arrays, to save with numpy
+    def arrays(self):
+        arrays = {
+            "values": numpy.frombuffer(self.values, numpy.uint8),
+            "offsets": numpy.frombuffer(self.offsets, numpy.uint64),
+        }
+        if self.row_by_key is not None:
+            keys = sorted(self.row_by_key, key=self.row_by_key.get)
+            key_bytes = [("\t".join(key) if isinstance(key, tuple) else key).encode() for key in keys]
+            arrays["key_bytes"] = numpy.frombuffer(b"".join(key_bytes), numpy.uint8)
+            arrays["key_offsets"] = numpy.zeros(len(keys) + 1, numpy.uint64)
+            numpy.cumsum([len(key) for key in key_bytes], out=arrays["key_offsets"][1:])
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays, name):
+        keys = None
+        if "key_bytes" in arrays:
+            key_bytes, key_offsets = arrays["key_bytes"].tobytes(), arrays["key_offsets"].tolist()
+            keys = [key_bytes[key_offsets[i]:key_offsets[i + 1]].decode() for i in range(len(key_offsets) - 1)]
+            if name == "trips_by_hour":
+                keys = [tuple(key.split("\t")) for key in keys]
+        return cls(memoryview(arrays["values"].tobytes()), memoryview(arrays["offsets"].tobytes()).cast("Q"), keys)
+
+
+def export(libvis, copy=False):
+    if not isinstance(libvis, ctypes.CDLL):
+        # the python engine (python_engine.py) builds its tables in memory python owns
+        return libvis.payload_tables()
+
+    tables = {}
+    for table, name in enumerate(table_names[:libvis.export_tables()]):
+        keys, key_offsets, values, value_offsets = (ctypes.c_void_p() for _ in range(4))
+        count = libvis.exported_table(
+            table, ctypes.byref(keys), ctypes.byref(key_offsets), ctypes.byref(values), ctypes.byref(value_offsets)
+        )
+        key_offsets = view(key_offsets.value, (count + 1) * 8).cast("Q")
+        value_offsets = view(value_offsets.value, (count + 1) * 8).cast("Q")
+        values = view(values.value, value_offsets[count])
+
+        key_list = None
+        if name in keyed_tables:
+            key_bytes = bytes(view(keys.value, key_offsets[count]))
+            key_list = [key_bytes[key_offsets[i]:key_offsets[i + 1]].decode() for i in range(count)]
+            if name == "trips_by_hour":
+                key_list = [tuple(key.split("\t")) for key in key_list]
+
+        table = PayloadTable(values, value_offsets, key_list)
+        tables[name] = table.copy() if copy else table
+    return tables
+
+
+# tables of the feed libvis just built, in memory python owns; libvis releases its own
+def take(libvis):
+    tables = {name: TripStore.build(table) if name == "trips" else table.copy() for name, table in export(libvis).items()}
+    libvis.release_tables()
+    return tables
+
+
+def save(tables, path):
+    arrays = {}
+    for name, table in tables.items():
+        arrays.update(("%s/%s" % (name, field), array) for field, array in table.arrays().items())
+    with open(path, "wb") as f:
+        numpy.savez(f, **arrays)
+
+
+def load(path):
+    fields = {}
+    with numpy.load(path) as data:
+        for key in data.files:
+            name, _, field = key.partition("/")
+            fields.setdefault(name, {})[field] = data[key]
+    return {
+        name: TripStore.from_arrays(arrays) if name == "trips" else PayloadTable.from_arrays(arrays, name)
+        for name, arrays in fields.items()
+    }
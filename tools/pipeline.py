@@ -0,0 +1,103 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+# Conversion stages declared as a DAG: a stage runs as soon as every value it
+# takes as input has been produced, on a thread pool. The converters spend most
+# of their time in numpy, file IO and libvis (ctypes drops the GIL for the whole
+# C++ call), so threads overlap them well while sharing the id registry.
+
+
+class Stage:
+    def __init__(self, name, func, inputs=(), outputs=()):
+        self.name = name
+        self.func = func
+        self.inputs = tuple(inputs)
+        self.outputs = tuple(outputs)
+
+    def run(self, values):
+        result = self.func(*[values[name] for name in self.inputs])
+        if len(self.outputs) == 1:
+            return {self.outputs[0]: result}
+        return dict(zip(self.outputs, result or ()))
+
+
+class Pipeline:
+    def __init__(self, stages):
+        self.stages = list(stages)
+        self.producers = {}
+        for stage in self.stages:
+            for output in stage.outputs:
+                if output in self.producers:
+                    raise ValueError("%s is produced by both %s and %s" % (output, self.producers[output].name, stage.name))
+                self.producers[output] = stage
+
+    def check(self, values, stages):
+        produced = {output for stage in stages for output in stage.outputs}
+        for stage in stages:
+            for name in stage.inputs:
+                if name not in values and name not in produced:
+                    raise ValueError("stage %s needs %s, which nothing produces" % (stage.name, name))
+
+    # the named stages and every stage that takes one of their outputs, transitively
+    def downstream(self, names):
+        names = set(names)
+        grown = True
+        while grown:
+            grown = False
+            for stage in self.stages:
+                if stage.name not in names and any(
+                    name in self.producers and self.producers[name].name in names for name in stage.inputs
+                ):
+                    names.add(stage.name)
+                    grown = True
+        return names
+
+    # every stage producing an input of the named stages, transitively, not the named ones
+    def upstream(self, names):
+        names = set(names)
+        found = set()
+        inputs = [name for stage in self.stages if stage.name in names for name in stage.inputs]
+        while inputs:
+            producer = self.producers.get(inputs.pop())
+            if producer is not None and producer.name not in found and producer.name not in names:
+                found.add(producer.name)
+                inputs.extend(producer.inputs)
+        return found
+
+    # only: names of the stages to run; values must then hold the outputs of the
+    # skipped stages that the ones run need
+    def run(self, values=None, max_workers=None, only=None):
+        values = dict(values or {})
+        pending = [stage for stage in self.stages if only is None or stage.name in only]
+        self.check(values, pending)
+        timings = {}
+        started = time.perf_counter()
+
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            running = {}
+            while pending or running:
+                for stage in [stage for stage in pending if all(name in values for name in stage.inputs)]:
+                    pending.remove(stage)
+                    running[pool.submit(self.timed, stage, values)] = stage
+
+                if not running:
+                    missing = sorted({name for stage in pending for name in stage.inputs if name not in values})
+                    raise ValueError("pipeline is stuck waiting for %s" % ", ".join(missing))
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    stage = running.pop(future)
+                    outputs, elapsed = future.result()
+                    values.update(outputs)
+                    timings[stage.name] = elapsed
+                    print("T\t%s took %.3fs" % (stage.name, elapsed))
+
+        timings["total"] = time.perf_counter() - started
+        print("T\tpipeline took %.3fs" % timings["total"])
+        return values, timings
+
+    @staticmethod
+    def timed(stage, values):
+        started = time.perf_counter()
+        outputs = stage.run(values)
+        return outputs, time.perf_counter() - started
@@ -0,0 +1,136 @@
+import gc
+import os
+import signal
+import socket
+import threading
+import time
+import traceback
+
+from werkzeug.serving import make_server
+
+# Production serving: the feed is loaded once in the master process, which then
+# forks workers that all accept on one shared listening socket. Workers inherit
+# the calendar, id registry and libvis tables copy-on-write; gc.freeze() keeps the
+# collector from writing to (and so copying) every object loaded before the fork.
+#
+# signals to the master:
+#   SIGHUP           replace the workers one by one, each after its successor is up
+#   SIGTERM, SIGINT  stop accepting, let workers finish in-flight requests, exit
+# a worker that dies is restarted; one that keeps dying is restarted more slowly
+
+
+def serve(app, host, port, workers, shutdown_timeout=30):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, int(port)))
+    sock.listen(1024)
+    sock.set_inheritable(True)
+
+    gc.collect()
+    gc.freeze()
+
+    children = {}
+    stopping = [False]
+    restart_delay = 0.0
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            # whatever happens, the child must never return into the master's loop
+            code = 1
+            try:
+                code = run_worker(app, host, port, sock)
+            except BaseException:
+                traceback.print_exc()
+            finally:
+                os._exit(code)
+        children[pid] = time.monotonic()
+        return pid
+
+    def stop_child(pid):
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+
+    def on_stop(sig, frame):
+        stopping[0] = True
+        for pid in list(children):
+            stop_child(pid)
+
+    def on_reload(sig, frame):
+        for old_pid in list(children):
+            spawn()
+            stop_child(old_pid)
+
+    previous_int = signal.signal(signal.SIGINT, on_stop)
+    previous_term = signal.signal(signal.SIGTERM, on_stop)
+    previous_hup = signal.signal(signal.SIGHUP, on_reload)
+
+    print("Serving on %s:%s with %d workers (master pid %d)" % (host, port, workers, os.getpid()))
+    try:
+        for _ in range(workers):
+            spawn()
+
+        deadline = None
+        while children:
+            if stopping[0] and deadline is None:
+                deadline = time.monotonic() + shutdown_timeout
+            if deadline is not None and time.monotonic() > deadline:
+                for pid in list(children):
+                    os.kill(pid, signal.SIGKILL)
+
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG if deadline else 0)
+            except ChildProcessError:
+                break
+            except InterruptedError:
+                continue
+            if pid == 0:
+                time.sleep(0.1)
+                continue
+
+            started = children.pop(pid, None)
+            if started is None or stopping[0]:
+                continue
+
+            # workers replaced by a SIGHUP already have their successor running
+            if len(children) >= workers:
+                continue
+
+            # a worker that crashed right after starting is restarted with backoff
+            if time.monotonic() - started < 1:
+                restart_delay = min(max(restart_delay * 2, 0.5), 30)
+            else:
+                restart_delay = 0.0
+            print("Worker %d exited with status %d, restarting" % (pid, status))
+            time.sleep(restart_delay)
+            spawn()
+    finally:
+        signal.signal(signal.SIGINT, previous_int)
+        signal.signal(signal.SIGTERM, previous_term)
+        signal.signal(signal.SIGHUP, previous_hup)
+        for pid in list(children):
+            stop_child(pid)
+        sock.close()
+
+
+def run_worker(app, host, port, sock):
+    # the master decides when workers stop; ctrl-c in the terminal reaches it too
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGHUP, signal.SIG_DFL)
+
+    server = make_server(host, int(port), app, threaded=True, fd=sock.fileno())
+    # finish in-flight requests before exiting
+    server.daemon_threads = False
+    server.block_on_close = True
+
+    def on_term(sig, frame):
+        threading.Thread(target=server.shutdown).start()
+
+    signal.signal(signal.SIGTERM, on_term)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+    return 0
@@ -0,0 +1,370 @@
+import array
+import collections
+import contextlib
+import gc
+import itertools
+import os
+import tempfile
+import numpy
+from . import external_sort
+from .csv_columns import ColumnReader, MissingColumns
+from .gtfs_source import DirectorySource
+from .id_registry import registry as ids
+from .payload_tables import PayloadTable
+
+# Builds the tables libvis builds (trips, trip_index, trips_by_hour,
+# itineraries) and the route files, in python, for hosts where
+# backend/lib/libvis.so cannot be built. It stands in for the library: same
+# generate_all and release_tables calls, and payload_tables.take() reads its
+# tables the way it reads libvis's, so artifact cache entries work with either.
+#
+# stop_times.txt is read in one pass into integer columns (trip row, stop row,
+# stop_sequence, seconds); sorting those groups every trip's stop times, and a
+# trip's itinerary is the bytes of its (stop_sequence, stop row) pairs. Like
+# libvis, a trip's times are the first one given for each stop_sequence,
+# arrival_time before departure_time. Stop times with neither are left out of
+# the timing list rather than read as garbage.
+#
+# Payloads are written the way libvis writes them (backend/src/sjson.h). Key
+# order inside an object, which itinerary gets which id and which trips are a
+# route's samples depend on hash map order in libvis; here they follow the feed.
+
+trip_fields = ["trip_id", "route_id", "block_id", "shape_id", "service_id", "trip_short_name", "trip_headsign"]
+route_fields = ["route_id", "route_type", "route_short_name", "route_long_name"]
+stop_fields = ["stop_id", "location_type", "stop_name", "stop_lat", "stop_lon"]
+stop_time_fields = ["trip_id", "stop_id", "stop_sequence", "arrival_time", "departure_time"]
+
+samples_per_itinerary = 3
+
+stop_time = numpy.dtype([("trip", numpy.int32), ("stop", numpy.int32), ("sequence", numpy.int64), ("time", numpy.int64)])
+sort_keys = ["trip", "sequence"]
+
+
+def json_str(value):
+    return '"%s"' % value.replace('"', '\\"')
+
+
+def json_object(pairs):
+    return "{\n%s\n}" % ",\n".join("    %s: %s" % (json_str(key), value) for key, value in pairs)
+
+
+def json_list(values):
+    return "[%s]" % ", ".join(values)
+
+
+trip_template = json_object(
+    [(field, "%s") for field in trip_fields]
+    + [(field, "%s") for field in ["departure_time", "timing_list", "itinerary_id", "route_jkey", "shape_jkey", "trip_jkey"]]
+)
+
+
+def format_time(seconds):
+    return "%02d:%02d:%02d" % (seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+
+# seconds after midnight of h:mm:ss, or -1
+def parse_time(time):
+    try:
+        h, m, s = time.split(":")
+        return 3600 * int(h) + 60 * int(m) + int(s)
+    except (AttributeError, ValueError):
+        return -1
+
+
+# parses each distinct string once: a feed repeats the same times and sequences
+# over and over
+class Memo(dict):
+    def __init__(self, parse):
+        super().__init__()
+        self.parse = parse
+
+    def __missing__(self, key):
+        value = self[key] = self.parse(key)
+        return value
+
+
+def parse_sequence(sequence):
+    try:
+        return int(sequence)
+    except ValueError:
+        try:
+            return int(float(sequence))
+        except ValueError:
+            return 0
+    except TypeError:
+        return 0
+
+
+# like libvis: the first row of each primary key wins, and keeps its row number
+def read_table(source, name, fields):
+    primary_key = fields[0]
+    if not source.exists(name):
+        print("No %s file found. Will not visualize." % name)
+        exit(1)
+    with source.open(name) as f:
+        try:
+            reader = ColumnReader(f, fields, required=[primary_key])
+        except MissingColumns:
+            print("No %s column in %s. Will not visualize." % (primary_key, name))
+            exit(1)
+
+        missing = [field for field in fields if not reader.has(field)]
+        for field in missing:
+            print("Adding empty field %s" % field)
+        columns = reader.columns + missing
+
+        rows = {}
+        for row_id, row in enumerate(reader.rows()):
+            if row[0] not in rows:
+                entry = dict(zip(columns, row))
+                entry.update((field, "") for field, value in entry.items() if value is None)
+                entry.update((field, "") for field in missing)
+                rows[row[0]] = (row_id, entry)
+    print("T\tloaded %s" % name)
+    return rows
+
+
+# the rows of stop_times.txt for stops and trips that exist, as records
+# rows_read, a collections.Counter, counts the rows read under "stop_times"
+def read_stop_times(source, trips, stops, rows_read, chunk_rows=1 << 16):
+    if not source.exists("stop_times.txt"):
+        print("No stop_times.txt file found. Will not visualize.")
+        exit(1)
+
+    trip_row = {trip_id: row for trip_id, (row, _) in trips.items()}
+    stop_row = {stop_id: row for stop_id, (row, _) in stops.items()}
+    parsed_times = Memo(parse_time)
+    parsed_sequences = Memo(parse_sequence)
+    with source.open("stop_times.txt") as f:
+        try:
+            reader = ColumnReader(f, stop_time_fields, required=stop_time_fields)
+        except MissingColumns as e:
+            print("Missing required attribute in stop_times.txt (%s). Unable to visualize." % e)
+            exit(1)
+
+        for chunk in reader.chunks(chunk_rows):
+            trip_ids, stop_ids, sequences, arrivals, departures = ColumnReader.columnar(chunk)
+            n = len(chunk)
+            rows_read["stop_times"] += n
+            records = numpy.empty(n, stop_time)
+            records["trip"] = numpy.fromiter(map(trip_row.get, trip_ids, itertools.repeat(-1)), numpy.int32, n)
+            records["stop"] = numpy.fromiter(map(stop_row.get, stop_ids, itertools.repeat(-1)), numpy.int32, n)
+            records["sequence"] = numpy.fromiter(map(parsed_sequences.__getitem__, sequences), numpy.int64, n)
+            times = numpy.fromiter(map(parsed_times.__getitem__, arrivals), numpy.int64, n)
+            for i in numpy.flatnonzero(times < 0).tolist():
+                if not arrivals[i]:
+                    times[i] = parsed_times[departures[i]]
+            records["time"] = times
+            yield records[(records["trip"] >= 0) & (records["stop"] >= 0)]
+
+
+# the rows are millions of tuples in no reference cycle: collecting while they
+# pile up only scans them over and over
+@contextlib.contextmanager
+def paused_gc():
+    collecting = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if collecting:
+            gc.enable()
+
+
+# the trips, their itineraries and trips by hour, built from the stop times of
+# a batch of trips at a time
+class TripTables:
+    def __init__(self, trips, routes):
+        self.trip_entries = [None] * (max((row for row, _ in trips.values()), default=-1) + 1)
+        for row, entry in trips.values():
+            self.trip_entries[row] = entry
+        self.routes = routes
+        self.trip_json = [b""] * len(self.trip_entries)
+        self.itineraries = {}
+        self.hours = {}
+
+    # stop_times: every stop time of the trips in it, sorted by trip, then
+    # stop_sequence, keeping file order among equal sequences
+    def add(self, stop_times):
+        trip_rows, stop_rows, sequences, times = (stop_times[field] for field in ["trip", "stop", "sequence", "time"])
+
+        # a trip's times: the first one given for each stop_sequence
+        timed = numpy.flatnonzero(times >= 0)
+        first_of_sequence = numpy.ones(len(timed), bool)
+        first_of_sequence[1:] = (trip_rows[timed[1:]] != trip_rows[timed[:-1]]) | (sequences[timed[1:]] != sequences[timed[:-1]])
+        timing_trips, timing = trip_rows[timed[first_of_sequence]], times[timed[first_of_sequence]]
+        timed_trips, timing_starts, timing_counts = numpy.unique(timing_trips, return_index=True, return_counts=True)
+        departures = timing[timing_starts]
+        offsets = list(map(str, (timing - numpy.repeat(departures, timing_counts)).tolist()))
+
+        # and its locations: distinct (stop_sequence, stop) pairs, in that order
+        repeated = (trip_rows[1:] == trip_rows[:-1]) & (sequences[1:] == sequences[:-1])
+        if repeated.any():
+            order = numpy.lexsort((stop_rows, sequences, trip_rows))
+            trip_rows, stop_rows, sequences = trip_rows[order], stop_rows[order], sequences[order]
+            distinct = numpy.ones(len(order), bool)
+            distinct[1:] = (trip_rows[1:] != trip_rows[:-1]) | (sequences[1:] != sequences[:-1]) | (stop_rows[1:] != stop_rows[:-1])
+            trip_rows, stop_rows, sequences = trip_rows[distinct], stop_rows[distinct], sequences[distinct]
+        locations = numpy.column_stack((sequences, stop_rows))
+        location_starts = numpy.searchsorted(trip_rows, timed_trips, "left")
+        location_ends = numpy.searchsorted(trip_rows, timed_trips, "right")
+
+        for row, departure, timing_start, timing_count, start, end in zip(
+            timed_trips.tolist(), departures.tolist(), timing_starts.tolist(), timing_counts.tolist(),
+            location_starts.tolist(), location_ends.tolist()
+        ):
+            trip = self.trip_entries[row]
+            route = self.routes.get(trip["route_id"])
+            if route is None:
+                print("Trip %s refers to non-existent route %s; destroyed." % (trip["trip_id"], trip["route_id"]))
+                continue
+
+            key = (route[0], locations[start:end].tobytes())
+            itinerary = self.itineraries.get(key)
+            if itinerary is None:
+                # a copy, not a view keeping the whole batch alive
+                itinerary = self.itineraries[key] = [len(self.itineraries), locations[start:end].copy(), trip, []]
+            if len(itinerary[3]) < samples_per_itinerary:
+                itinerary[3].append(row)
+
+            route_jkey, service_jkey = ids.routes.jkey_of(trip["route_id"]), ids.services.jkey_of(trip["service_id"])
+            self.trip_json[row] = (trip_template % (
+                *(json_str(trip[field]) for field in trip_fields),
+                json_str(format_time(departure)),
+                json_list(offsets[timing_start:timing_start + timing_count]),
+                itinerary[0],
+                json_str(route_jkey),
+                json_str(ids.shapes.jkey_of(trip["shape_id"])),
+                json_str(str(row)),
+            )).encode()
+            self.hours.setdefault((route_jkey, service_jkey), []).append((departure, row))
+
+
+class PythonEngine:
+    # stop_times_max_bytes: if set, stop_times.txt is sorted on disk, holding
+    # about this much of it in memory at once, instead of all of it
+    def __init__(self, stop_times_max_bytes=0):
+        self.stop_times_max_bytes = stop_times_max_bytes
+        self.tables = {}
+
+    # gtfs: a GTFS source (gtfs_source.py), read as it is, zipped or not, or
+    # the path of a directory, as libvis takes it. returns the number of
+    # stop_times.txt rows read, as libvis does
+    def generate_all(self, gtfs, out_dir):
+        source = DirectorySource(os.fsdecode(gtfs)) if isinstance(gtfs, (bytes, str)) else gtfs
+        out_dir = os.fsdecode(out_dir)
+
+        stops = read_table(source, "stops.txt", stop_fields)
+        trips = read_table(source, "trips.txt", trip_fields)
+        routes = read_table(source, "routes.txt", route_fields)
+        stop_entries = {row: entry for row, entry in stops.values()}
+
+        rows_read = collections.Counter()
+        trip_tables = TripTables(trips, routes)
+        for stop_times in self.sorted_stop_times(source, trips, stops, rows_read):
+            trip_tables.add(stop_times)
+        itineraries = trip_tables.itineraries
+        print("|itineraries| = %d" % len(itineraries))
+        print("|trips| = %d" % sum(1 for payload in trip_tables.trip_json if payload))
+
+        self.tables = {"trips": PayloadTable(*pack(trip_tables.trip_json))}
+        print("T\tready to serve /trips from memory")
+
+        self.tables["trip_index"] = keyed_table({trip_id: b'"%d"' % row for trip_id, (row, _) in trips.items()})
+        print("T\tready to serve /trip_index from memory")
+
+        by_hour = {}
+        for hour_key, departures in trip_tables.hours.items():
+            trips_in_hours = {}
+            for departure, row in sorted(departures):
+                trips_in_hours.setdefault(departure // 3600, []).append(json_str(str(row)))
+            by_hour[hour_key] = json_object(
+                (str(hour), json_list(rows)) for hour, rows in sorted(trips_in_hours.items())
+            ).encode()
+        self.tables["trips_by_hour"] = keyed_table(by_hour)
+        print("T\tready to serve /trips_by_route_by_hour from memory")
+
+        # itineraries in the order libvis keeps them: by route, then stops
+        ordered = sorted(itineraries.items(), key=lambda item: (item[0][0], item[1][1].ravel().tolist()))
+        self.write_routes(out_dir, ordered, routes)
+
+        itinerary_json = [b""] * len(itineraries)
+        for _, (itinerary_id, locations, sample_trip, _) in ordered:
+            stop_list = []
+            for stop_row in locations[:, 1].tolist():
+                stop = stop_entries[stop_row]
+                try:
+                    coordinates = "%g, %g" % (float(stop["stop_lat"]), float(stop["stop_lon"]))
+                except ValueError:
+                    print("Stop %s has no valid stop_lat and stop_lon. Unable to visualize." % stop["stop_id"])
+                    exit(1)
+                stop_list.append("[%s, %s]" % (json_str(stop["stop_id"]), coordinates))
+            first_stop = stop_entries[int(locations[0, 1])]
+            last_stop = stop_entries[int(locations[-1, 1])]
+            name = "%s → %s, %d stops" % (first_stop["stop_name"], last_stop["stop_name"], len(locations))
+            itinerary_json[itinerary_id] = json_object(
+                [
+                    ("itinerary_name", json_str(name)),
+                    ("shape_jkey", json_str(ids.shapes.jkey_of(sample_trip["shape_id"]))),
+                    ("stop_list", json_list(stop_list)),
+                ]
+            ).encode()
+        self.tables["itineraries"] = PayloadTable(*pack(itinerary_json))
+        print("T\tready to serve /itineraries from memory")
+        return rows_read["stop_times"]
+
+    # stop times of whole trips, sorted by trip, then stop_sequence
+    def sorted_stop_times(self, source, trips, stops, rows_read):
+        if not self.stop_times_max_bytes:
+            with paused_gc():
+                chunks = list(read_stop_times(source, trips, stops, rows_read))
+            yield external_sort.sort_records(numpy.concatenate(chunks or [numpy.zeros(0, stop_time)]), sort_keys)
+            return
+
+        # sorting a run takes about twice its size again
+        run_rows = max(self.stop_times_max_bytes // (3 * stop_time.itemsize), 1 << 10)
+        with tempfile.TemporaryDirectory(prefix="viz-stop-times-") as spill_dir:
+            with paused_gc():
+                runs = external_sort.spill(
+                    read_stop_times(source, trips, stops, rows_read, min(run_rows, 1 << 16)), sort_keys, spill_dir, run_rows
+                )
+            print("T\tsorted stop_times.txt into %d runs" % len(runs))
+            block_rows = max(run_rows // (2 * max(len(runs), 1)), 1 << 10)
+            yield from external_sort.merge(runs, stop_time, sort_keys, block_rows)
+
+    @staticmethod
+    def write_routes(out_dir, ordered, routes):
+        samples = {}
+        for _, (_, _, sample_trip, sample_rows) in ordered:
+            samples.setdefault(sample_trip["route_id"], []).extend(sample_rows)
+
+        for route_id, sample_rows in samples.items():
+            route = routes[route_id][1]
+            body = json_object(
+                [(field, json_str(route[field])) for field in route_fields]
+                + [("sample_trip_jkeys", json_list(json_str(str(row)) for row in sample_rows))]
+            )
+            with open(os.path.join(out_dir, "routes", ids.routes.jkey_of(route_id) + ".json"), "w") as f:
+                f.write(body)
+        print("T\twrote /routes to disk")
+
+    def payload_tables(self):
+        return dict(self.tables)
+
+    def release_tables(self):
+        self.tables = {}
+
+
+# values and offsets of a PayloadTable holding payloads
+def pack(payloads):
+    offsets = array.array("Q", [0])
+    total = 0
+    for payload in payloads:
+        total += len(payload)
+        offsets.append(total)
+    return memoryview(b"".join(payloads)), memoryview(offsets)
+
+
+def keyed_table(rows):
+    values, offsets = pack(list(rows.values()))
+    return PayloadTable(values, offsets, list(rows))
@@ -0,0 +1,114 @@
+import threading
+from collections import OrderedDict
+
+# LRU of fully assembled response bodies, bounded by their total size in bytes.
+# Concurrent misses on the same key are coalesced: the first caller computes the
+# body, later callers wait for it instead of repeating the work.
+# sizeof gives the size of an entry, for caching values other than bytes. Every
+# entry is also charged entry_bytes for its key, value object and dict node, so
+# a budget filled with tiny bodies still bounds the memory held. The size charged
+# is kept with the entry; resize() recharges an entry whose value has grown.
+
+entry_bytes = 256
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class ResponseCache:
+    def __init__(self, max_bytes, sizeof=len):
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.entries = OrderedDict()
+        self.sizes = {}
+        self.size = 0
+        self.in_flight = {}
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    def get(self, key, compute):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+
+            call = self.in_flight.get(key)
+            owner = call is None
+            if owner:
+                call = self.in_flight[key] = _Call()
+                self.misses += 1
+            else:
+                self.coalesced += 1
+
+        if not owner:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.value
+
+        try:
+            call.value = compute()
+        except BaseException as e:
+            call.error = e
+            raise
+        else:
+            with self.lock:
+                self._put(key, call.value)
+        finally:
+            with self.lock:
+                del self.in_flight[key]
+            call.done.set()
+
+        return call.value
+
+    def _put(self, key, value):
+        size = self.sizeof(value) + entry_bytes
+        if size > self.max_bytes:
+            return
+
+        self.entries[key] = value
+        self.sizes[key] = size
+        self.size += size
+        self._evict()
+
+    def _evict(self):
+        while self.size > self.max_bytes:
+            key, _ = self.entries.popitem(last=False)
+            self.size -= self.sizes.pop(key)
+            self.evictions += 1
+
+    def resize(self, key):
+        with self.lock:
+            if key not in self.entries:
+                return
+            size = self.sizeof(self.entries[key]) + entry_bytes
+            self.size += size - self.sizes[key]
+            self.sizes[key] = size
+            self._evict()
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.sizes.clear()
+            self.size = 0
+
+    def stats(self):
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "bytes": self.size,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "evictions": self.evictions,
+            }
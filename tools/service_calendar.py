@@ -0,0 +1,119 @@
+import datetime
+import numpy
+
+# active services are stored day by day, CSR style:
+#   service_index[day_ptr[d]:day_ptr[d + 1]] are the services active on first_day + d
+# so a date lookup is two array reads and a slice, and a date range is one slice
+
+
+def parse_date(date):
+    return datetime.date(int(date[:4]), int(date[4:6]), int(date[6:8])).toordinal()
+
+
+# date is exactly YYYYMMDD, a day that exists
+def is_date(date):
+    if len(date) != 8 or not date.isascii() or not date.isdigit():
+        return False
+    try:
+        parse_date(date)
+    except ValueError:
+        return False
+    return True
+
+
+def format_date(ordinal):
+    return datetime.date.fromordinal(ordinal).strftime("%Y%m%d")
+
+
+class ServiceCalendar:
+    def __init__(self, first_day, service_jkeys, day_ptr, service_index):
+        self.first_day = first_day
+        self.service_jkeys = service_jkeys
+        self.day_ptr = day_ptr
+        self.service_index = service_index
+
+    # periods: (service, start ordinal, end ordinal, weekday flags monday first)
+    # exceptions: {(service, ordinal): added}, already folded in file order
+    @classmethod
+    def build(cls, service_jkeys, periods, exceptions):
+        days = [start for _, start, _, _ in periods] + [end for _, _, end, _ in periods]
+        days += [day for _, day in exceptions]
+        if not days:
+            return cls(0, service_jkeys, numpy.zeros(1, numpy.int64), numpy.zeros(0, numpy.int32))
+
+        first_day, last_day = min(days), max(days)
+        num_services = max(len(service_jkeys), 1)
+
+        keys = []
+        for service, start, end, weekdays in periods:
+            start_weekday = datetime.date.fromordinal(start).weekday()
+            for weekday, runs in enumerate(weekdays):
+                if runs:
+                    first = start + (weekday - start_weekday) % 7
+                    offsets = numpy.arange(first - first_day, end - first_day + 1, 7, dtype=numpy.int64)
+                    keys.append(offsets * num_services + service)
+
+        removed = [(day - first_day) * num_services + service for (service, day), added in exceptions.items() if not added]
+        added = [(day - first_day) * num_services + service for (service, day), added in exceptions.items() if added]
+
+        keys = numpy.concatenate(keys) if keys else numpy.zeros(0, numpy.int64)
+        if removed:
+            keys = keys[~numpy.isin(keys, numpy.array(removed, numpy.int64))]
+        keys = numpy.unique(numpy.concatenate((keys, numpy.array(added, numpy.int64))))
+
+        day_ptr = numpy.searchsorted(keys // num_services, numpy.arange(last_day - first_day + 2))
+        return cls(first_day, service_jkeys, day_ptr, (keys % num_services).astype(numpy.int32))
+
+    def day_range(self, start, end):
+        num_days = len(self.day_ptr) - 1
+        return max(start - self.first_day, 0), min(end - self.first_day + 1, num_days)
+
+    def active(self, date):
+        try:
+            day = parse_date(date) - self.first_day
+        except ValueError:
+            return []
+        if day < 0 or day >= len(self.day_ptr) - 1:
+            return []
+
+        jkeys = self.service_jkeys
+        return [jkeys[i] for i in self.service_index[self.day_ptr[day]:self.day_ptr[day + 1]].tolist()]
+
+    # every date from start_date to end_date inclusive that has service, mapped to its services
+    def active_between(self, start_date, end_date):
+        start, end = self.day_range(parse_date(start_date), parse_date(end_date))
+        jkeys = self.service_jkeys
+        active_by_date = {}
+        for day in range(start, end):
+            services = self.service_index[self.day_ptr[day]:self.day_ptr[day + 1]].tolist()
+            if services:
+                active_by_date[format_date(self.first_day + day)] = [jkeys[i] for i in services]
+        return active_by_date
+
+    # services that run at least once from start_date to end_date inclusive
+    def any_active_between(self, start_date, end_date):
+        start, end = self.day_range(parse_date(start_date), parse_date(end_date))
+        if start >= end:
+            return []
+        services = numpy.unique(self.service_index[self.day_ptr[start]:self.day_ptr[end]])
+        return [self.service_jkeys[i] for i in services.tolist()]
+
+    def save(self, path):
+        with open(path, "wb") as f:
+            numpy.savez(
+                f,
+                first_day=numpy.int64(self.first_day),
+                service_jkeys=numpy.array(self.service_jkeys, dtype=str),
+                day_ptr=self.day_ptr,
+                service_index=self.service_index,
+            )
+
+    @classmethod
+    def load(cls, path):
+        with numpy.load(path) as saved:
+            return cls(
+                int(saved["first_day"]),
+                saved["service_jkeys"].tolist(),
+                saved["day_ptr"],
+                saved["service_index"],
+            )
@@ -0,0 +1,77 @@
+import math
+import numpy
+
+# Besides at full resolution, every shape is stored simplified for each zoom in
+# levels, with Douglas-Peucker at a tolerance of half a screen pixel at that zoom.
+# A request for zoom z gets the first level at or above z, or the full shape past
+# the last one.
+
+levels = [8, 10, 12]
+tile_size = 256
+
+
+def level_for(zoom):
+    if zoom is None:
+        return None
+    for level in levels:
+        if zoom <= level:
+            return level
+    return None
+
+
+def tolerance(zoom, lat):
+    # half a pixel, in degrees of latitude, since simplify works on lon * cos(lat)
+    return 0.5 * 360.0 / (tile_size * 2 ** zoom) * math.cos(math.radians(lat))
+
+
+# Douglas-Peucker, splitting every open segment of the line at once each round
+# instead of recursing into them one at a time. returns a mask of the points to keep
+def simplify(coords, tol):
+    n = len(coords)
+    keep = numpy.zeros(n, dtype=bool)
+    keep[[0, n - 1]] = True
+    if n <= 2:
+        return keep
+
+    xy = numpy.array(coords, dtype=numpy.float64)
+    xy[:, 0] *= math.cos(math.radians(xy[:, 1].mean()))
+
+    starts = numpy.array([0])
+    ends = numpy.array([n - 1])
+    while len(starts):
+        inner = ends - starts - 1
+        open_segs = inner > 0
+        starts, ends, inner = starts[open_segs], ends[open_segs], inner[open_segs]
+        if not len(starts):
+            break
+
+        first = numpy.cumsum(inner) - inner
+        seg = numpy.repeat(numpy.arange(len(starts)), inner)
+        points = starts[seg] + 1 + numpy.arange(inner.sum()) - first[seg]
+
+        # distance from each point to the chord of its segment
+        a = xy[starts[seg]]
+        ab = xy[ends[seg]] - a
+        ap = xy[points] - a
+        length2 = numpy.einsum("ij,ij->i", ab, ab)
+        t = numpy.einsum("ij,ij->i", ap, ab) / numpy.where(length2 > 0, length2, 1.0)
+        t = numpy.clip(t, 0.0, 1.0)
+        dist = numpy.hypot(*(ap - t[:, None] * ab).T)
+
+        farthest = numpy.maximum.reduceat(dist, first)
+        is_far = numpy.flatnonzero(dist == farthest[seg])
+        _, first_far = numpy.unique(seg[is_far], return_index=True)
+        split = points[is_far[first_far]]
+
+        split_segs = farthest > tol
+        split = split[split_segs]
+        keep[split] = True
+        starts, ends = numpy.r_[starts[split_segs], split], numpy.r_[split, ends[split_segs]]
+
+    return keep
+
+
+def simplified_levels(coords):
+    lat = float(numpy.mean(coords[:, 1])) if len(coords) else 0.0
+    for level in levels:
+        yield level, coords[simplify(coords, tolerance(level, lat))]
@@ -0,0 +1,120 @@
+import json
+import os
+import numpy
+from . import shape_simplify
+
+# All shapes live in two files instead of one GeoJSON file per shape:
+#   shapes/shapes.pack       int32 (lon, lat) pairs in millionths of a degree, one run of
+#                            points per shape per level: the first point of a run is
+#                            absolute, the rest are deltas from the point before
+#   shapes/shapes.index.npz  jkeys (shape_jkey per row), and offsets and counts
+#                            (row, column) in points into the pack
+# column 0 is the full shape, column i is shape_simplify.levels[i - 1]. The pack is
+# memory-mapped, so forked workers share it and only the shapes served get paged in.
+
+pack_name = "shapes.pack"
+index_name = "shapes.index.npz"
+scale = 1000000
+
+
+def column(zoom):
+    level = shape_simplify.level_for(zoom)
+    return 0 if level is None else shape_simplify.levels.index(level) + 1
+
+
+class ShapeStoreWriter:
+    def __init__(self, shapes_dir):
+        self.shapes_dir = shapes_dir
+        self.pack = open(os.path.join(shapes_dir, pack_name), "wb")
+        self.jkeys = []
+        self.offsets = []
+        self.counts = []
+        self.written = 0
+
+    # runs: coordinates of the shape, rounded to 6 decimals, for every column
+    def add(self, shape_jkey, runs):
+        offsets = []
+        counts = []
+        for coords in runs:
+            fixed = numpy.rint(numpy.asarray(coords) * scale).astype(numpy.int64).reshape(-1, 2)
+            deltas = numpy.diff(fixed, axis=0, prepend=numpy.zeros((1, 2), numpy.int64))
+            offsets.append(self.written)
+            counts.append(len(deltas))
+            self.pack.write(deltas.astype("<i4").tobytes())
+            self.written += len(deltas)
+
+        self.jkeys.append(shape_jkey)
+        self.offsets.append(offsets)
+        self.counts.append(counts)
+
+    def close(self):
+        self.pack.close()
+        num_columns = len(shape_simplify.levels) + 1
+        numpy.savez(
+            os.path.join(self.shapes_dir, index_name),
+            jkeys=numpy.array(self.jkeys, dtype="S32"),
+            offsets=numpy.array(self.offsets, dtype=numpy.int64).reshape(-1, num_columns),
+            counts=numpy.array(self.counts, dtype=numpy.int64).reshape(-1, num_columns),
+        )
+        return self.written * 8
+
+
+class ShapeStore:
+    def __init__(self, jkeys, offsets, counts, points):
+        self.row_by_jkey = {jkey: row for row, jkey in enumerate(jkeys)}
+        self.offsets = offsets
+        self.counts = counts
+        self.points = points
+
+    @classmethod
+    def open(cls, shapes_dir):
+        index_path = os.path.join(shapes_dir, index_name)
+        pack_path = os.path.join(shapes_dir, pack_name)
+        if not os.path.isfile(index_path):
+            return None
+
+        with numpy.load(index_path) as index:
+            jkeys = [jkey.decode() for jkey in index["jkeys"]]
+            offsets, counts = index["offsets"], index["counts"]
+        if os.path.getsize(pack_path):
+            points = numpy.memmap(pack_path, dtype="<i4", mode="r").reshape(-1, 2)
+        else:
+            points = numpy.zeros((0, 2), dtype="<i4")
+        return cls(jkeys, offsets, counts, points)
+
+    def __contains__(self, shape_jkey):
+        return shape_jkey in self.row_by_jkey
+
+    def deltas(self, shape_jkey, col=0):
+        row = self.row_by_jkey[shape_jkey]
+        start = self.offsets[row, col]
+        return self.points[start:start + self.counts[row, col]]
+
+    def coords(self, shape_jkey, col=0):
+        return numpy.cumsum(self.deltas(shape_jkey, col), axis=0, dtype=numpy.int64) / scale
+
+    def geojson(self, shape_jkey, col=0):
+        geojson_feature = {
+            "type": "Feature",
+            "geometry": {"type": "LineString", "coordinates": self.coords(shape_jkey, col).tolist()},
+            "properties": {},
+        }
+        return json.dumps(geojson_feature).encode()
+
+    # encoded polyline with 6 decimal places ("polyline6"), (lat, lon) order.
+    # the pack already holds the deltas it encodes
+    def polyline(self, shape_jkey, col=0):
+        return encode_polyline(self.deltas(shape_jkey, col)[:, ::-1])
+
+
+def encode_polyline(deltas):
+    values = numpy.asarray(deltas, dtype=numpy.int64).ravel()
+    values = (values << 1) ^ (values >> 63)
+
+    # int32 deltas zigzag into at most 33 bits, 7 chunks of 5
+    shifts = numpy.arange(0, 35, 5)
+    chunks = (values[:, None] >> shifts) & 31
+    lengths = 1 + ((values[:, None] >> shifts[1:]) > 0).sum(axis=1)
+    present = shifts // 5 < lengths[:, None]
+    more = shifts // 5 < lengths[:, None] - 1
+    return ((chunks | more * 0x20) + 63)[present].astype(numpy.uint8).tobytes()
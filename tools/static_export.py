@@ -0,0 +1,177 @@
+import hashlib
+import itertools
+import json
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from . import compression
+from .service_calendar import format_date
+from .shape_store import column
+
+# Writes everything the visualizer asks a feed for into a directory that a
+# plain web server, CDN or object store can serve without python: the page and
+# its scripts, the generated files, and every response the server builds on
+# request (trips, itineraries, trip_index, trips_by_date and shapes), each at
+# the path it is requested at.
+#
+# Each distinct response is written once, as an object named by its content
+# hash, with .gz/.br siblings compressed at the highest settings, and the
+# request paths are hardlinks to it (copies where links cannot be made).
+# Objects never change, so they can be cached forever. manifest.json maps every
+# request path to its object.
+#
+# Query strings cannot be answered statically. Shapes are written at full
+# resolution whatever the zoom, and the batch, active trips, vehicles and stop
+# bbox endpoints are left out; without batch the page fetches trips one by one.
+#
+# trips_by_date is only written for the days a route runs. Every other date,
+# unknown routes and trip ids missing from trip_index cannot all be written
+# out: the manifest's fallbacks give the object the server should answer a
+# miss under each of those paths with, the body the live server sends ([] and
+# "NOT_FOUND"). Unknown trips and itineraries are 404s in both.
+
+objects_dir = os.path.join(".visualizefiles", "objects")
+static_dirs = ["js", "css", "files"]
+
+# responses handed to the writer threads at a time
+batch_size = 1024
+
+# body the live server sends for a path under each of these that has no file
+fallbacks = {
+    "trips_by_date/": b"[]",
+    "trip_index/": b'"NOT_FOUND"',
+}
+
+
+def object_path(digest):
+    return os.path.join(objects_dir, digest[:2], digest[2:] + ".json")
+
+
+# a trip_id that can be a file name as it is
+def file_name(trip_id):
+    return trip_id not in ("", ".", "..") and "/" not in trip_id and "\0" not in trip_id and len(trip_id.encode()) < 250
+
+
+# (path under .visualizefiles, body) of every response the server would build for feed
+def responses(feed):
+    trips = feed.tables["trips"]
+    for row in range(len(trips)):
+        yield "trips/%d.json" % row, trips.get(row)
+
+    # an itinerary is requested under the route of each trip that follows it
+    active = feed.active_trips()
+    itineraries = feed.tables["itineraries"]
+    for route_jkey, itinerary_id in sorted(set(zip(active.route_jkeys, active.itinerary_ids.tolist()))):
+        payload = itineraries.get(itinerary_id)
+        if payload is not None:
+            yield "itineraries/%s/itin_%d.json" % (route_jkey, itinerary_id), payload
+
+    trip_index = feed.tables["trip_index"]
+    skipped = 0
+    for trip_id, row in trip_index.row_by_key.items():
+        if file_name(trip_id):
+            yield "trip_index/%s.json" % trip_id, trip_index.get(row)
+        else:
+            skipped += 1
+    if skipped:
+        print("%d trip ids cannot be file names and were left out of trip_index" % skipped)
+
+    # days a route does not run are left to the trips_by_date fallback
+    calendar = feed.service_by_date
+    num_days = len(calendar.day_ptr) - 1
+    if num_days:
+        for date in calendar.active_between(format_date(calendar.first_day), format_date(calendar.first_day + num_days - 1)):
+            for route_jkey in feed.ids.routes.jkeys:
+                body = feed.trips_on_date(date, route_jkey)
+                if body != fallbacks["trips_by_date/"]:
+                    yield "trips_by_date/%s/%s.json" % (date, route_jkey), body
+
+    if feed.shapes is not None:
+        full = column(None)
+        for shape_jkey in feed.shapes.row_by_jkey:
+            yield "shapes/%s.json" % shape_jkey, feed.shapes.geojson(shape_jkey, full)
+
+
+def link(source, destination):
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copyfile(source, destination)
+
+
+def copy_static(feed, root):
+    # the shape pack is replaced by one file per shape
+    shutil.copytree(feed.out_dir, os.path.join(root, ".visualizefiles"),
+                    ignore=lambda directory, names: ["shapes"] if os.path.samefile(directory, feed.out_dir) else [])
+    for suffix in [""] + [compression.suffix(encoding) for encoding in compression.encodings()]:
+        if os.path.isfile(os.path.join(feed.out_dir, "visualizer.html" + suffix)):
+            shutil.copyfile(os.path.join(feed.out_dir, "visualizer.html" + suffix), os.path.join(root, "index.html" + suffix))
+    for name in static_dirs:
+        if os.path.isdir(name):
+            shutil.copytree(name, os.path.join(root, name))
+            compression.precompress_tree(os.path.join(root, name))
+
+
+# exports feed into export_dir, replacing what is there once the export is complete
+def export(feed, export_dir, threads=None):
+    export_dir = export_dir.rstrip(os.sep)
+    root = "%s.%d.tmp" % (export_dir, os.getpid())
+    shutil.rmtree(root, ignore_errors=True)
+    copy_static(feed, root)
+
+    suffixes = [""] + [compression.suffix(encoding) for encoding in compression.encodings()]
+    files = {}
+    object_bytes = {}
+
+    def write_object(item):
+        digest, body = item
+        path = os.path.join(root, object_path(digest))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(body)
+        if len(body) >= compression.min_size:
+            compression.precompress_file(path)
+
+    def link_response(item):
+        path, digest = item
+        destination = os.path.join(root, ".visualizefiles", path)
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        source = os.path.join(root, object_path(digest))
+        for suffix in suffixes:
+            if os.path.isfile(source + suffix):
+                link(source + suffix, destination + suffix)
+
+    # objects are written before the paths linking to them; zlib, brotli and
+    # file writes release the GIL, so the threads overlap
+    pieces = itertools.chain(responses(feed), ((None, body) for body in fallbacks.values()))
+    with ThreadPoolExecutor(max_workers=threads or os.cpu_count()) as pool:
+        for batch in iter(lambda: list(itertools.islice(pieces, batch_size)), []):
+            new_objects = {}
+            links = []
+            for path, body in batch:
+                body = bytes(body)
+                digest = hashlib.sha256(body).hexdigest()
+                if digest not in object_bytes:
+                    object_bytes[digest] = len(body)
+                    new_objects[digest] = body
+                if path is not None:
+                    files[".visualizefiles/" + path] = object_path(digest).replace(os.sep, "/")
+                    links.append((path, digest))
+            list(pool.map(write_object, new_objects.items()))
+            list(pool.map(link_response, links))
+
+    manifest = {
+        "cache_key": feed.cache_key,
+        "objects": len(object_bytes),
+        "files": files,
+        "fallbacks": {
+            ".visualizefiles/" + prefix: object_path(hashlib.sha256(body).hexdigest()).replace(os.sep, "/")
+            for prefix, body in fallbacks.items()
+        },
+    }
+    with open(os.path.join(root, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+
+    shutil.rmtree(export_dir, ignore_errors=True)
+    os.rename(root, export_dir)
+    return len(files), len(object_bytes), sum(object_bytes.values())
@@ -0,0 +1,120 @@
+import json
+import math
+import os
+import numpy
+from . import metrics
+
+# Stops are indexed in web mercator (slippy map) tiles from min_zoom to max_zoom:
+#   stops/tiles/<z>/<x>/<y>.json   object (key=stop_id): stop_lat, stop_lon, stop_name
+# max_zoom tiles hold every stop. Lower zoom tiles are thinned to at most one stop
+# per 1/thin_grid of the tile on each axis, so a city-wide view stays light.
+# Tiles are static files, so they are cacheable and get precompressed like the rest.
+#
+# The max_zoom tile of each stop is also looked up by stop_id, so the popup of a
+# stop does not depend on coordinates rounded on their way to the map:
+#   stops/tiles/index/<shard>.json   object (key=stop_id): [x, y]
+# where shard is stop_shard(stop_id), computed the same way in js/tools.js.
+
+min_zoom = 10
+max_zoom = 14
+thin_grid = 16
+
+
+def tile_xy(lats, lons, zoom):
+    n = 2 ** zoom
+    lats = numpy.clip(numpy.asarray(lats, dtype=numpy.float64), -85.0511, 85.0511)
+    lons = numpy.asarray(lons, dtype=numpy.float64)
+    x = numpy.floor((lons + 180.0) / 360.0 * n)
+    y = numpy.floor((1.0 - numpy.arcsinh(numpy.tan(numpy.radians(lats))) / math.pi) / 2.0 * n)
+    return numpy.clip(x, 0, n - 1).astype(numpy.int64), numpy.clip(y, 0, n - 1).astype(numpy.int64)
+
+
+index_shards = 256
+
+
+def tile_path(tiles_dir, zoom, x, y):
+    return os.path.join(tiles_dir, str(zoom), str(x), "%d.json" % y)
+
+
+# java's String.hashCode over utf-16 code units, which javascript strings are made of
+def stop_shard(stop_id):
+    h = 0
+    for unit in memoryview(stop_id.encode("utf-16-le")).cast("H"):
+        h = (h * 31 + unit) & 0xFFFFFFFF
+    return h % index_shards
+
+
+def write_tile_index(stop_ids, xs, ys, tiles_dir):
+    shards = {}
+    for stop_id, x, y in zip(stop_ids, xs.tolist(), ys.tolist()):
+        shards.setdefault(stop_shard(stop_id), {})[stop_id] = [x, y]
+
+    written = 0
+    os.makedirs(os.path.join(tiles_dir, "index"), exist_ok=True)
+    for shard, tiles in shards.items():
+        with open(os.path.join(tiles_dir, "index", "%d.json" % shard), "w") as out:
+            json.dump(tiles, out)
+            written += out.tell()
+    return written
+
+
+@metrics.stage("stop_tiles")
+def write_stop_tiles(stops_obj, tiles_dir):
+    stop_ids = list(stops_obj)
+    lats = numpy.array([stops_obj[stop_id]["stop_lat"] for stop_id in stop_ids], dtype=numpy.float64)
+    lons = numpy.array([stops_obj[stop_id]["stop_lon"] for stop_id in stop_ids], dtype=numpy.float64)
+
+    written = 0
+    for zoom in range(min_zoom, max_zoom + 1):
+        xs, ys = tile_xy(lats, lons, zoom)
+        keep = numpy.arange(len(stop_ids))
+        if zoom < max_zoom:
+            sub_x, sub_y = tile_xy(lats, lons, zoom + int(math.log2(thin_grid)))
+            _, keep = numpy.unique(sub_x * (thin_grid << zoom) + sub_y, return_index=True)
+
+        keys = xs[keep] * (1 << zoom) + ys[keep]
+        order = numpy.argsort(keys, kind="stable")
+        keep, keys = keep[order], keys[order]
+        starts = numpy.flatnonzero(numpy.r_[True, keys[1:] != keys[:-1]]) if len(keys) else []
+        ends = numpy.r_[starts[1:], len(keys)] if len(keys) else []
+        for start, end in zip(starts, ends):
+            first = keep[start]
+            path = tile_path(tiles_dir, zoom, int(xs[first]), int(ys[first]))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "w") as out:
+                json.dump({stop_ids[i]: stops_obj[stop_ids[i]] for i in keep[start:end].tolist()}, out)
+                written += out.tell()
+
+    written += write_tile_index(stop_ids, *tile_xy(lats, lons, max_zoom), tiles_dir)
+    metrics.add("stop_tiles", rows=len(stop_ids), bytes=written)
+
+
+def tile_ranges(west, south, east, north, zoom):
+    (x0, x1), (y1, y0) = (v.tolist() for v in tile_xy([south, north], [west, east], zoom))
+    return range(x0, x1 + 1), range(y0, y1 + 1)
+
+
+def tiles_in_bbox(west, south, east, north, zoom):
+    xs, ys = tile_ranges(west, south, east, north, zoom)
+    return [(x, y) for x in xs for y in ys]
+
+
+# a box too big for max_tiles tiles at the requested zoom is answered from coarser,
+# thinned tiles; None if it is too big even at min_zoom
+def stops_in_bbox(tiles_dir, west, south, east, north, zoom, load_tile, max_tiles=64):
+    zoom = min(max(int(zoom), min_zoom), max_zoom)
+    # count before listing: a continent-sized box covers millions of max_zoom tiles
+    xs, ys = tile_ranges(west, south, east, north, zoom)
+    while len(xs) * len(ys) > max_tiles and zoom > min_zoom:
+        zoom -= 1
+        xs, ys = tile_ranges(west, south, east, north, zoom)
+    if len(xs) * len(ys) > max_tiles:
+        return None
+    tiles = tiles_in_bbox(west, south, east, north, zoom)
+
+    stops = {}
+    for x, y in tiles:
+        for stop_id, stop in load_tile(tile_path(tiles_dir, zoom, x, y)).items():
+            if south <= stop["stop_lat"] <= north and west <= stop["stop_lon"] <= east:
+                stops[stop_id] = stop
+    return stops
@@ -0,0 +1,143 @@
+import argparse
+import datetime
+import math
+import os
+import random
+
+# Writes a synthetic but well-formed GTFS feed for benchmarking. Every file is
+# streamed out row by row, so feeds with tens of millions of stop_times can be
+# generated without holding them in memory.
+#
+#   stop_times rows = routes * 2 directions * trips_per_direction * stops_per_trip
+#
+# e.g. --routes 500 --trips-per-direction 500 --stops-per-trip 40 gives 20M.
+
+
+def format_time(seconds):
+    return "%02d:%02d:%02d" % (seconds // 3600, seconds % 3600 // 60, seconds % 60)
+
+
+def generate(
+    out_dir,
+    routes=50,
+    trips_per_direction=100,
+    stops_per_trip=25,
+    stops=2000,
+    shape_points=400,
+    timing_patterns=4,
+    days=365,
+    seed=0,
+):
+    rng = random.Random(seed)
+    os.makedirs(out_dir, exist_ok=True)
+
+    def out(name):
+        return open(os.path.join(out_dir, name), "w", encoding="utf-8", newline="", buffering=1 << 20)
+
+    with out("agency.txt") as f:
+        f.write("agency_id,agency_name,agency_url,agency_timezone\n")
+        f.write("synth,Synthetic Transit,https://example.com,America/Montreal\n")
+
+    # stops on a jittered grid around a city centre
+    side = int(math.ceil(math.sqrt(stops)))
+    stop_coords = []
+    with out("stops.txt") as f:
+        f.write("stop_id,stop_name,stop_lat,stop_lon,location_type\n")
+        for i in range(stops):
+            lat = 45.40 + (i // side) * 0.004 + rng.uniform(-0.001, 0.001)
+            lon = -73.80 + (i % side) * 0.006 + rng.uniform(-0.001, 0.001)
+            stop_coords.append((lat, lon))
+            f.write("S%d,Stop %d,%.6f,%.6f,0\n" % (i, i, lat, lon))
+
+    services = ["weekday", "saturday", "sunday"]
+    start = datetime.date(2021, 1, 4)
+    end = start + datetime.timedelta(days=days - 1)
+    with out("calendar.txt") as f:
+        f.write("service_id,monday,tuesday,wednesday,thursday,friday,saturday,sunday,start_date,end_date\n")
+        for service, flags in zip(services, ["1,1,1,1,1,0,0", "0,0,0,0,0,1,0", "0,0,0,0,0,0,1"]):
+            f.write("%s,%s,%s,%s\n" % (service, flags, start.strftime("%Y%m%d"), end.strftime("%Y%m%d")))
+
+    # a holiday every 30 days runs the sunday service instead
+    with out("calendar_dates.txt") as f:
+        f.write("service_id,date,exception_type\n")
+        for offset in range(0, days, 30):
+            day = start + datetime.timedelta(days=offset)
+            if day.weekday() < 5:
+                f.write("weekday,%s,2\n" % day.strftime("%Y%m%d"))
+                f.write("sunday,%s,1\n" % day.strftime("%Y%m%d"))
+
+    with out("routes.txt") as f:
+        f.write("route_id,agency_id,route_short_name,route_long_name,route_type\n")
+        for r in range(routes):
+            f.write("R%d,synth,%d,Synthetic Line %d,3\n" % (r, r, r))
+
+    patterns = {}
+    with out("shapes.txt") as f:
+        f.write("shape_id,shape_pt_lat,shape_pt_lon,shape_pt_sequence\n")
+        for r in range(routes):
+            pattern = rng.sample(range(stops), min(stops_per_trip, stops))
+            for direction, stop_list in enumerate([pattern, pattern[::-1]]):
+                patterns[(r, direction)] = stop_list
+                coords = [stop_coords[s] for s in stop_list]
+                for p in range(shape_points):
+                    pos = p * (len(coords) - 1) / max(shape_points - 1, 1)
+                    i = min(int(pos), len(coords) - 2) if len(coords) > 1 else 0
+                    frac = pos - i
+                    a, b = coords[i], coords[min(i + 1, len(coords) - 1)]
+                    lat = a[0] + (b[0] - a[0]) * frac + rng.uniform(-0.0002, 0.0002)
+                    lon = a[1] + (b[1] - a[1]) * frac + rng.uniform(-0.0002, 0.0002)
+                    f.write("SH%d_%d,%.6f,%.6f,%d\n" % (r, direction, lat, lon, p + 1))
+
+    with out("trips.txt") as trips_file, out("stop_times.txt") as stop_times_file:
+        trips_file.write("route_id,service_id,trip_id,trip_headsign,direction_id,shape_id\n")
+        stop_times_file.write("trip_id,arrival_time,departure_time,stop_id,stop_sequence\n")
+        for r in range(routes):
+            for direction in range(2):
+                stop_list = patterns[(r, direction)]
+                # a handful of run time patterns per itinerary, like a real schedule
+                run_times = [
+                    [rng.randint(60, 180) for _ in stop_list[1:]] for _ in range(timing_patterns)
+                ]
+                for t in range(trips_per_direction):
+                    service = services[t % len(services)]
+                    trip_id = "T%d_%d_%d" % (r, direction, t)
+                    trips_file.write("R%d,%s,%s,Stop %d,%d,SH%d_%d\n" % (r, service, trip_id, stop_list[-1], direction, r, direction))
+
+                    now = 5 * 3600 + (t * 20 * 3600) // trips_per_direction
+                    pattern = run_times[t % timing_patterns]
+                    rows = []
+                    for seq, stop in enumerate(stop_list):
+                        if seq:
+                            now += pattern[seq - 1]
+                        time = format_time(now)
+                        rows.append("%s,%s,%s,S%d,%d\n" % (trip_id, time, time, stop, seq + 1))
+                    stop_times_file.write("".join(rows))
+
+    return routes * 2 * trips_per_direction * len(patterns[(0, 0)]) if routes else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write a synthetic GTFS feed for benchmarking.")
+    parser.add_argument("out_dir")
+    parser.add_argument("--routes", type=int, default=50)
+    parser.add_argument("--trips-per-direction", type=int, default=100)
+    parser.add_argument("--stops-per-trip", type=int, default=25)
+    parser.add_argument("--stops", type=int, default=2000)
+    parser.add_argument("--shape-points", type=int, default=400)
+    parser.add_argument("--timing-patterns", type=int, default=4)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rows = generate(
+        args.out_dir,
+        routes=args.routes,
+        trips_per_direction=args.trips_per_direction,
+        stops_per_trip=args.stops_per_trip,
+        stops=args.stops,
+        shape_points=args.shape_points,
+        timing_patterns=args.timing_patterns,
+        days=args.days,
+        seed=args.seed,
+    )
+    print("wrote %s with %d stop_times" % (args.out_dir, rows))
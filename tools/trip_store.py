@@ -0,0 +1,125 @@
+import array
+import itertools
+import numpy
+
+# The trips table, stored by value instead of one JSON string per trip. Trips of
+# an itinerary mostly share their timing_list, and many their departure_time,
+# route, shape, service and headsign, so every field value is kept once in a
+# pool and a trip is the row of pool ids of its fields. get() joins a trip back
+# together, byte for byte the payload it was built from, when it is requested.
+#
+# A payload is "{\n" then '    "key": value' lines joined by ",\n" then "\n}"
+# (backend/src/sjson.h). The keys of a trip, in order, are its layout; there is
+# one per engine in practice. A payload that does not split back into itself is
+# kept whole, as the single value of an empty layout.
+
+line_separator = b',\n    "'
+
+
+def split(payload):
+    if not payload.startswith(b'{\n    "') or not payload.endswith(b"\n}"):
+        return None
+    fields = [line.split(b'": ', 1) for line in payload[len(b'{\n    "'):-2].split(line_separator)]
+    if any(len(field) != 2 for field in fields):
+        return None
+    keys, values = tuple(key for key, _ in fields), [value for _, value in fields]
+    if join(key_prefixes(keys), values) != payload:
+        return None
+    return keys, values
+
+
+def key_prefixes(keys):
+    return [b'{\n    "%b": ' % keys[0]] + [b'%b%b": ' % (line_separator, key) for key in keys[1:]] if keys else []
+
+
+def join(prefixes, values):
+    if not prefixes:
+        return b"".join(values)
+    return b"".join(itertools.chain.from_iterable(zip(prefixes, values))) + b"\n}"
+
+
+class TripStore:
+    row_by_key = None
+
+    def __init__(self, layouts, trip_layout, id_ptr, value_ids, pool, pool_offsets):
+        self.layouts = layouts
+        self.prefixes = [key_prefixes(keys) for keys in layouts]
+        self.trip_layout = trip_layout
+        self.id_ptr = id_ptr
+        self.value_ids = value_ids
+        self.pool = pool
+        self.pool_offsets = pool_offsets
+
+    # from a PayloadTable of trip payloads
+    @classmethod
+    def build(cls, table):
+        layouts = {}
+        pool = {}
+        trip_layout = array.array("i")
+        id_ptr = array.array("q", [0])
+        value_ids = array.array("i")
+        for row in range(len(table)):
+            payload = bytes(table.get(row))
+            if not payload:
+                trip_layout.append(-1)
+                id_ptr.append(len(value_ids))
+                continue
+
+            fields = split(payload)
+            keys, values = fields if fields is not None else ((), [payload])
+            trip_layout.append(layouts.setdefault(keys, len(layouts)))
+            value_ids.extend(pool.setdefault(value, len(pool)) for value in values)
+            id_ptr.append(len(value_ids))
+
+        pool_offsets = numpy.zeros(len(pool) + 1, numpy.uint64)
+        numpy.cumsum([len(value) for value in pool], out=pool_offsets[1:])
+        return cls(
+            list(layouts),
+            numpy.frombuffer(trip_layout, numpy.int32),
+            numpy.frombuffer(id_ptr, numpy.int64),
+            numpy.frombuffer(value_ids, numpy.int32),
+            b"".join(pool),
+            pool_offsets,
+        )
+
+    def __len__(self):
+        return len(self.trip_layout)
+
+    def nbytes(self):
+        arrays = [self.trip_layout, self.id_ptr, self.value_ids, self.pool_offsets]
+        return sum(array.nbytes for array in arrays) + len(self.pool)
+
+    # already in memory python owns
+    def copy(self):
+        return self
+
+    def get(self, row):
+        if not 0 <= row < len(self.trip_layout):
+            return None
+        layout = self.trip_layout[row]
+        if layout < 0:
+            return b""
+        offsets, pool = self.pool_offsets, self.pool
+        values = [pool[offsets[i]:offsets[i + 1]] for i in self.value_ids[self.id_ptr[row]:self.id_ptr[row + 1]].tolist()]
+        return join(self.prefixes[layout], values)
+
+    # as arrays, to save with numpy
+    def arrays(self):
+        return {
+            "layouts": numpy.array([b"\n".join(keys) for keys in self.layouts], dtype=bytes),
+            "layout_sizes": numpy.array([len(keys) for keys in self.layouts], numpy.int64),
+            "trip_layout": self.trip_layout,
+            "id_ptr": self.id_ptr,
+            "value_ids": self.value_ids,
+            "pool": numpy.frombuffer(self.pool, numpy.uint8),
+            "pool_offsets": self.pool_offsets,
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        layouts = [
+            tuple(keys.split(b"\n")) if size else ()
+            for keys, size in zip(arrays["layouts"].tolist(), arrays["layout_sizes"].tolist())
+        ]
+        return cls(layouts, arrays["trip_layout"], arrays["id_ptr"], arrays["value_ids"],
+                   arrays["pool"].tobytes(), arrays["pool_offsets"])
@@ -0,0 +1,89 @@
+import json
+import math
+import time
+import numpy
+from .active_trips import day_seconds
+from .service_calendar import format_date, parse_date
+
+# Where every running trip of a feed is, computed in one batch per moment and
+# pushed to clients as server-sent events. Each tick the clock moves on by the
+# tick times speed and one event is sent:
+#   {"time": "08:00:05", "positions": [lat, lon, lat, lon, ...]}
+# with "trip_jkeys", in the order of positions, only when the running trips
+# changed since the event before. Every event's id is the moment it shows, so
+# a client that reconnects (EventSource does so by itself) resumes from there.
+
+
+def format_time(seconds):
+    seconds = int(seconds)
+    return "%02d:%02d:%02d" % (seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+
+# the same moment as a date and seconds into it, 0 <= seconds < 24h
+def normalize(date, seconds):
+    days, seconds = divmod(seconds, day_seconds)
+    return format_date(parse_date(date) + int(days)), seconds
+
+
+# fastest the clock may run: a day a second
+max_speed = day_seconds
+
+
+# speed of the clock from a speed argument; ValueError unless 0 < speed <= max_speed
+def parse_speed(speed):
+    speed = float(speed)
+    if not 0 < speed <= max_speed:
+        raise ValueError("speed out of range: %r" % speed)
+    return speed
+
+
+def event_id(date, seconds):
+    return "%s/%s" % (date, ("%.3f" % seconds).rstrip("0").rstrip("."))
+
+
+def parse_event_id(last_event_id):
+    date, _, seconds = last_event_id.partition("/")
+    parse_date(date)
+    seconds = float(seconds)
+    # ids are only sent for normalized moments
+    if not math.isfinite(seconds) or not 0 <= seconds < day_seconds:
+        raise ValueError("seconds out of range: %r" % seconds)
+    return date, seconds
+
+
+# jkeys of the trips running at a moment and their positions. bbox: (west,
+# south, east, north) to keep only the trips inside it
+def frame(active, service_by_date, date, seconds, bbox=None):
+    trips, service_seconds = active.at(service_by_date, date, int(seconds))
+    positions = active.positions(trips, service_seconds + (seconds - int(seconds)))
+    if bbox is not None:
+        west, south, east, north = bbox
+        lat, lon = positions[:, 0], positions[:, 1]
+        inside = (lon >= west) & (lat >= south) & (lon <= east) & (lat <= north)
+        trips, positions = trips[inside], positions[inside]
+    return [str(row) for row in active.trip_rows[trips].tolist()], numpy.round(positions, 6)
+
+
+def frame_json(trip_jkeys, positions, seconds, send_jkeys=True):
+    body = {"time": format_time(seconds), "positions": positions.ravel().tolist()}
+    if send_jkeys:
+        body["trip_jkeys"] = trip_jkeys
+    return json.dumps(body, separators=(",", ":"))
+
+
+# events from date and seconds on, one every tick seconds, for at most
+# max_seconds before the client is left to reconnect
+def stream(active, service_by_date, date, seconds, tick, speed, bbox=None, max_seconds=3600):
+    sent_jkeys = None
+    deadline = time.monotonic() + max_seconds
+    next_tick = time.monotonic()
+    while time.monotonic() < deadline:
+        date, seconds = normalize(date, seconds)
+        trip_jkeys, positions = frame(active, service_by_date, date, seconds, bbox)
+        data = frame_json(trip_jkeys, positions, seconds, trip_jkeys != sent_jkeys)
+        sent_jkeys = trip_jkeys
+        yield ("id: %s\ndata: %s\n\n" % (event_id(date, seconds), data)).encode()
+
+        next_tick += tick
+        time.sleep(max(next_tick - time.monotonic(), 0))
+        seconds += tick * speed
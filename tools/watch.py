@@ -0,0 +1,42 @@
+import threading
+import time
+import zipfile
+from .artifact_cache import gtfs_files
+
+# Polls a GTFS source (gtfs_source.py) and calls on_change once its files have
+# changed and then stayed put for a whole interval, so a feed being copied in
+# file by file is picked up once, after the copy, rather than half written.
+# Polling needs nothing beyond the standard library and works on any filesystem.
+
+
+def signature(source):
+    try:
+        return source.stats(gtfs_files)
+    except (OSError, zipfile.BadZipFile):
+        # a zip being replaced can be missing or truncated for a moment
+        return None
+
+
+def watch(source, on_change, interval=2.0):
+    def poll():
+        seen = signature(source)
+        while True:
+            time.sleep(interval)
+            current = signature(source)
+            if current == seen:
+                continue
+            while True:
+                time.sleep(interval)
+                settled = signature(source)
+                if settled == current:
+                    break
+                current = settled
+            seen = current
+            try:
+                on_change()
+            except (Exception, SystemExit) as e:
+                print("Reloading %s failed, still serving the previous version: %r" % (source, e))
+
+    thread = threading.Thread(target=poll, name="watch", daemon=True)
+    thread.start()
+    return thread
@@ -57,7 +57,7 @@ html_end = """
 </html>
 """
 
-def write_html(routes_obj):
+def write_html(routes_obj, html_path):
     def sort_function(route_item):
         return route_item[1]['route_short_name']
 
@@ -85,7 +85,7 @@ def write_html(routes_obj):
         html_middle += '</td></tr>'
     html_middle += '\n'
 
-    with open('.visualizefiles/visualizer.html', 'w') as htmlfile:
+    with open(html_path, 'w') as htmlfile:
         htmlfile.write(html_start)
         htmlfile.write(html_middle)
         htmlfile.write(html_end)
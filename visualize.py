@@ -6,60 +6,375 @@ import shutil
 import http.server
 import socketserver
 from tools.conversion_tools import convert_calendars, convert_routes, convert_shapes, convert_trips
+from tools import artifact_cache
+from tools.id_registry import registry as ids
+from tools.response_cache import ResponseCache
+from tools.pipeline import Pipeline, Stage
+from tools import metrics
+from tools import prefork
+from tools import compression
+from tools import stop_tiles
+from tools import shape_store
+from tools import payload_tables
+from tools import python_engine
+from tools import feeds
+from tools import watch
+from tools import active_trips
+from tools import vehicle_stream
+from tools import service_calendar
+from tools import static_export
+from tools.gtfs_source import open_source
 import ctypes
 import datetime
-from flask import Flask, send_from_directory, Response, send_file
+import mimetypes
+from flask import Flask, Blueprint, send_from_directory, Response, send_file, jsonify, request, abort, g
+from werkzeug.security import safe_join
+import functools
+import glob
+import itertools
+import json
+import math
+import numpy
 import threading, webbrowser
 
 
-libvis = ctypes.CDLL('./backend/lib/libvis.so')
-libvis.serve_trip.restype = ctypes.c_char_p
-libvis.serve_itinerary.restype = ctypes.c_char_p
-libvis.serve_trip_index.restype = ctypes.c_char_p
-libvis.serve_trips_by_hour.restype = ctypes.c_char_p
+# if set, stop_times.txt is sorted on disk holding about this many bytes of it in
+# memory, for feeds too large to convert in memory. only the python engine can
+stop_times_max_bytes = int(os.environ.get('VIZ_STOP_TIMES_MAX_BYTES', 0))
+libvis = None
+if not stop_times_max_bytes:
+    try:
+        libvis = ctypes.CDLL('./backend/lib/libvis.so')
+    except OSError as e:
+        # without the C++ backend, trips and itineraries are built in python, more slowly
+        print('Could not load backend/lib/libvis.so (%s). Using the python engine.' % e)
+if libvis is None:
+    libvis = python_engine.PythonEngine(stop_times_max_bytes)
+else:
+    libvis.generate_all.restype = ctypes.c_uint64
+    libvis.release_tables.restype = None
+    payload_tables.declare(libvis)
 now = datetime.datetime.utcnow()
 last_modified = now.strftime('%a, %d %b %Y %H:%M:%S GMT')
 expires = (now + datetime.timedelta(hours=1)).strftime('%a, %d %b %Y %H:%M:%S GMT')
 
+trips_by_date_cache = ResponseCache(int(os.environ.get('TRIPS_BY_DATE_CACHE_BYTES', 64 << 20)))
+compressed_cache = ResponseCache(int(os.environ.get('COMPRESSED_CACHE_BYTES', 64 << 20)))
+shape_cache = ResponseCache(int(os.environ.get('SHAPE_CACHE_BYTES', 32 << 20)))
+
+# the feed served at /, when visualizing a single feed
+feed = None
+
+# feeds served at /feeds/<name>/, when visualizing a directory of feeds. they are
+# loaded on first use and the least recently used are dropped past the budget
+feeds_dir = '.visualizefeeds'
+feed_sources = {}
+feed_cache = ResponseCache(int(os.environ.get('VIZ_FEEDS_MAX_BYTES', 1 << 30)), sizeof=lambda feed: feed.nbytes())
+
+# libvis and the id registry hold the feed being converted or loaded
+libvis_lock = threading.Lock()
+cache_dir = os.environ.get('VIZ_CACHE_DIR', '.visualizecache')
+
 app = Flask(__name__)
+metrics.instrument(app)
+metrics.register_cache('trips_by_date', trips_by_date_cache)
+metrics.register_cache('compressed', compressed_cache)
+metrics.register_cache('shapes', shape_cache)
+metrics.register_cache('feeds', feed_cache)
+
+feed_routes = Blueprint('feed', __name__)
 
-@app.route('/')
+@feed_routes.url_value_preprocessor
+def select_feed(endpoint, values):
+    name = values.pop('feed_name', None) if values else None
+    g.feed = feed if name is None else open_feed(name)
+    if g.feed is None:
+        abort(404)
+
+def open_feed(name):
+    if name not in feed_sources:
+        return None
+    return feed_cache.get(name, lambda: load_named_feed(name))
+
+def send_static(directory, path):
+    full_path = safe_join(directory or '.', path)
+    if full_path is None or not path.endswith(compression.compressible):
+        return send_from_directory(directory, path)
+
+    variant_path, encoding = compression.variant(full_path, request.headers.get('Accept-Encoding', ''))
+    if encoding is None:
+        resp = send_from_directory(directory, path)
+    else:
+        resp = send_file(variant_path, mimetype=mimetypes.guess_type(path)[0] or 'application/octet-stream')
+        resp.headers['Content-Encoding'] = encoding
+    resp.headers['Vary'] = 'Accept-Encoding'
+    return resp
+
+# cached: False for responses that are not asked for twice, kept out of compressed_cache
+def json_response(make_body, compress=True, key=None, cached=True):
+    encoding = compression.negotiate(request.headers.get('Accept-Encoding', '')) if compress else None
+    if encoding is None:
+        # a memoryview payload gets its one copy here, WSGI servers only take bytes
+        resp = Response(bytes(make_body()), mimetype='application/json')
+    else:
+        make_compressed = lambda: compression.compress(make_body(), encoding, best=False)
+        body = compressed_cache.get((g.feed.cache_key, key or request.path, encoding), make_compressed) if cached else make_compressed()
+        resp = Response(body, mimetype='application/json')
+        resp.headers['Content-Encoding'] = encoding
+    if compress:
+        resp.headers['Vary'] = 'Accept-Encoding'
+    return resp
+
+@feed_routes.route('/')
 def home():
-    return send_file('.visualizefiles/visualizer.html')
+    return send_static(g.feed.out_dir, 'visualizer.html')
 
 @app.after_request
 def enable_caching(resp):
+    if resp.headers.get('Cache-Control') == 'no-store':
+        return resp
     resp.headers['Cache-Control'] = 'public; max-age=3600'
     resp.headers['Last-Modified'] = last_modified
     resp.headers['Expires'] = expires
     return resp
 
-@app.route('/<path:path>')
+@feed_routes.route('/<path:path>')
 def static_files(path):
-    return send_from_directory('', path)
+    generated, _, generated_path = path.partition('/')
+    if generated == '.visualizefiles':
+        return send_static(g.feed.out_dir, generated_path)
+    return send_static('', path)
+
+@feed_routes.route('/.visualizefiles/shapes/<shape_jkey>.json')
+def serve_shape(shape_jkey):
+    shapes = g.feed.shapes
+    if shapes is None or shape_jkey not in shapes:
+        abort(404)
+
+    col = shape_store.column(request.args.get('zoom', type=float))
+    if request.args.get('format') == 'polyline':
+        body = shape_cache.get((g.feed.cache_key, 'polyline', shape_jkey, col), lambda: shapes.polyline(shape_jkey, col))
+        return Response(body, mimetype='text/plain')
 
-@app.route('/.visualizefiles/trips/<int:trip_id>.json')
+    make_body = lambda: shape_cache.get((g.feed.cache_key, 'geojson', shape_jkey, col), lambda: shapes.geojson(shape_jkey, col))
+    return json_response(make_body, key=('shape', shape_jkey, col))
+
+def payload_response(table, row):
+    payload = g.feed.tables[table].get(row)
+    if payload is None:
+        abort(404)
+    return json_response(lambda: payload)
+
+@feed_routes.route('/.visualizefiles/trips/<int:trip_id>.json')
 def serve_trip(trip_id):
-    return Response(libvis.serve_trip(trip_id), mimetype='application/json')
+    return payload_response('trips', trip_id)
 
-@app.route('/.visualizefiles/itineraries/<ignore>/itin_<int:itin_id>.json')
+@feed_routes.route('/.visualizefiles/itineraries/<ignore>/itin_<int:itin_id>.json')
 def serve_itinerary(ignore, itin_id):
-    return Response(libvis.serve_itinerary(itin_id), mimetype='application/json')
+    return payload_response('itineraries', itin_id)
+
+# POST {"trips": [trip ids], "itineraries": [itinerary ids]}, get back
+# {"trips": {id: trip}, "itineraries": {id: itinerary}} streamed as it is built.
+# ids that do not exist are left out
+max_batch_ids = int(os.environ.get('VIZ_MAX_BATCH_IDS', 5000))
+
+def batch_items(ids_wanted, table):
+    separator = b''
+    for i in ids_wanted:
+        payload = table.get(i)
+        if payload:
+            yield b'%b"%d": ' % (separator, i)
+            yield payload
+            separator = b', '
+
+@feed_routes.route('/.visualizefiles/batch', methods=['POST'])
+def serve_batch():
+    wanted = request.get_json(silent=True)
+    if not isinstance(wanted, dict):
+        abort(400)
+    try:
+        trip_ids = list(dict.fromkeys(int(i) for i in wanted.get('trips', [])))
+        itinerary_ids = list(dict.fromkeys(int(i) for i in wanted.get('itineraries', [])))
+    except (TypeError, ValueError):
+        abort(400)
+    if len(trip_ids) + len(itinerary_ids) > max_batch_ids:
+        abort(413)
+
+    tables = g.feed.tables
+
+    def generate():
+        yield b'{"trips": {'
+        yield from batch_items(trip_ids, tables['trips'])
+        yield b'}, "itineraries": {'
+        yield from batch_items(itinerary_ids, tables['itineraries'])
+        yield b'}}'
 
-@app.route('/.visualizefiles/trip_index/<trip_id>.json')
+    # written out a few hundred items at a time rather than one by one
+    pieces = generate()
+    chunks = (b''.join(group) for group in iter(lambda: list(itertools.islice(pieces, 256)), []))
+
+    encoding = compression.negotiate(request.headers.get('Accept-Encoding', ''))
+    body = chunks if encoding is None else compression.compress_stream(chunks, encoding)
+    resp = Response(body, mimetype='application/json')
+    if encoding is not None:
+        resp.headers['Content-Encoding'] = encoding
+    resp.headers['Vary'] = 'Accept-Encoding'
+    resp.headers['Cache-Control'] = 'no-store'
+    return resp
+
+@feed_routes.route('/.visualizefiles/trip_index/<trip_id>.json')
 def serve_trip_index(trip_id):
-    return Response(libvis.serve_trip_index(trip_id.encode()), mimetype='application/json')
+    payload = g.feed.tables['trip_index'].lookup(trip_id)
+    return json_response(lambda: b'"NOT_FOUND"' if payload is None else payload, compress=False)
 
-@app.route('/.visualizefiles/trips_by_date/<date>/<route_id>.json')
+@feed_routes.route('/.visualizefiles/trips_by_date/<date>/<route_id>.json')
 def serve_trips_by_hour(date, route_id):
-    results = []
-    for service_jkey in service_by_date.get(date, []):
-        result = libvis.serve_trips_by_hour(route_id.encode(), service_jkey.encode())
-        if result:
-            results.append(result)
+    if not service_calendar.is_date(date):
+        abort(400)
+    feed = g.feed
+    route_code = feed.ids.routes.code_of_jkey(route_id)
+    # only dates with service are cached, so arbitrary dates cannot fill the cache with empty lists
+    if route_code is None or not feed.service_by_date.active(date):
+        return Response(b'[]', mimetype='application/json')
+
+    return json_response(lambda: trips_by_date_cache.get((feed.cache_key, date, route_code),
+                                                         lambda: feed.trips_on_date(date, route_id)))
+
+# the feed's index of running trips. building it makes a feed held in feed_cache larger
+def active_trips_of(feed):
+    built = feed.active is None
+    active = feed.active_trips()
+    if built and feed.name:
+        feed_cache.resize(feed.name)
+    return active
+
+# (west, south, east, north) of the bbox argument, if given
+def bbox_arg():
+    if 'bbox' not in request.args:
+        return None
+    bbox = tuple(float(v) for v in request.args['bbox'].split(','))
+    if len(bbox) != 4:
+        raise ValueError(bbox)
+    return bbox
+
+# every trip running on date at time (hh:mm:ss), network wide, with the stop it
+# last reached. bbox=<west>,<south>,<east>,<north> keeps those whose stop is in it
+@feed_routes.route('/.visualizefiles/active_trips.json')
+def serve_active_trips():
+    try:
+        date = request.args['date']
+        seconds = active_trips.parse_time(request.args['time'])
+        bbox = bbox_arg()
+        trips, service_seconds = active_trips_of(g.feed).at(g.feed.service_by_date, date, seconds)
+    except (KeyError, ValueError):
+        abort(400)
+
+    def assemble():
+        active = active_trips_of(g.feed)
+        stop_index, positions = active.last_stops(trips, service_seconds)
+        keep = numpy.ones(len(trips), bool)
+        if bbox is not None:
+            west, south, east, north = bbox
+            keep = (positions[:, 1] >= west) & (positions[:, 0] >= south) & (positions[:, 1] <= east) & (positions[:, 0] <= north)
+        return json.dumps([
+            {'trip_jkey': str(row), 'route_jkey': active.route_jkeys[trip], 'itinerary_id': itinerary_id,
+             'stop_index': stop, 'position': position}
+            for trip, row, itinerary_id, stop, position in zip(
+                trips[keep].tolist(), active.trip_rows[trips[keep]].tolist(), active.itinerary_ids[trips[keep]].tolist(),
+                stop_index[keep].tolist(), positions[keep].tolist())
+        ]).encode()
+
+    return json_response(assemble, key=(request.path, date, seconds, bbox))
+
+# vehicle positions: every running trip placed between the stops it is
+# travelling between, at date and time (by default now), optionally within bbox
+vehicle_tick_seconds = float(os.environ.get('VIZ_VEHICLE_TICK_SECONDS', 1))
+vehicle_stream_seconds = float(os.environ.get('VIZ_VEHICLE_STREAM_SECONDS', 3600))
+
+def vehicle_args():
+    now = datetime.datetime.now()
+    date = request.args.get('date', now.strftime('%Y%m%d'))
+    time = request.args.get('time')
+    seconds = now.hour * 3600 + now.minute * 60 + now.second if time is None else active_trips.parse_time(time)
+    service_calendar.parse_date(date)
+    return date, seconds, bbox_arg()
+
+@feed_routes.route('/.visualizefiles/vehicles.json')
+def serve_vehicles():
+    try:
+        date, seconds, bbox = vehicle_args()
+    except ValueError:
+        abort(400)
+    feed = g.feed
+    trip_jkeys, positions = vehicle_stream.frame(active_trips_of(feed), feed.service_by_date, date, seconds, bbox)
+    # a frame of now is stale by the next tick: neither kept here nor by browsers and CDNs
+    now = 'date' not in request.args or 'time' not in request.args
+    resp = json_response(lambda: vehicle_stream.frame_json(trip_jkeys, positions, seconds).encode(),
+                         key=(request.path, date, seconds, bbox), cached=not now)
+    if now:
+        resp.headers['Cache-Control'] = 'no-store'
+    return resp
+
+# the same, as server-sent events every VIZ_VEHICLE_TICK_SECONDS, the clock
+# running speed times faster than real time
+@feed_routes.route('/.visualizefiles/vehicles/stream')
+def serve_vehicle_stream():
+    try:
+        date, seconds, bbox = vehicle_args()
+        speed = vehicle_stream.parse_speed(request.args.get('speed', 1))
+        if 'Last-Event-ID' in request.headers:
+            date, seconds = vehicle_stream.parse_event_id(request.headers['Last-Event-ID'])
+            seconds += vehicle_tick_seconds * speed
+    except ValueError:
+        abort(400)
+
+    feed = g.feed
+    events = vehicle_stream.stream(active_trips_of(feed), feed.service_by_date, date, seconds,
+                                   vehicle_tick_seconds, speed, bbox, vehicle_stream_seconds)
+    resp = Response(events, mimetype='text/event-stream')
+    resp.headers['Cache-Control'] = 'no-store'
+    resp.headers['X-Accel-Buffering'] = 'no'
+    return resp
+
+@functools.lru_cache(maxsize=4096)
+def load_stop_tile(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+@feed_routes.route('/.visualizefiles/stops/bbox.json')
+def serve_stops_in_bbox():
+    try:
+        west, south, east, north = (float(v) for v in request.args['bbox'].split(','))
+        # map.getZoom() is fractional mid-animation and with zoomSnap < 1
+        zoom = math.floor(float(request.args.get('zoom', stop_tiles.max_zoom)))
+    except (KeyError, ValueError, OverflowError):
+        abort(400)
+
+    stops = stop_tiles.stops_in_bbox(os.path.join(g.feed.out_dir, 'stops', 'tiles'),
+                                     west, south, east, north, zoom, load_stop_tile)
+    if stops is None:
+        abort(413)
+    return json_response(lambda: json.dumps(stops).encode(), key=(request.path, west, south, east, north, zoom))
+
+@app.route('/cache_stats')
+def serve_cache_stats():
+    resp = jsonify(trips_by_date=trips_by_date_cache.stats(), compressed=compressed_cache.stats(), shapes=shape_cache.stats(),
+                   feeds=feed_cache.stats())
+    resp.headers['Cache-Control'] = 'no-store'
+    return resp
 
-    return Response(b'[%b]' % b', '.join(results), mimetype='application/json')
+@app.route('/feeds/')
+def serve_feed_list():
+    with feed_cache.lock:
+        loaded = set(feed_cache.entries)
+    resp = jsonify({name: {'loaded': name in loaded} for name in feed_sources})
+    resp.headers['Cache-Control'] = 'no-store'
+    return resp
 
+app.register_blueprint(feed_routes)
 
 
 def signal_handler(sig, frame):
@@ -68,10 +383,198 @@ def signal_handler(sig, frame):
         shutil.rmtree('.visualizefiles')
     except:
         print('No previous visualized files found on close. Weird.')
+    shutil.rmtree(feeds_dir, ignore_errors=True)
+    for generation_dir in glob.glob('.visualizefiles.*'):
+        shutil.rmtree(generation_dir, ignore_errors=True)
     exit(0)
 
-def cpp_backend(in_dir, out_dir):
-    libvis.generate_all(in_dir.encode(), out_dir.encode())
+# libvis reads files from a directory: a zipped feed is decompressed into shared memory for it
+libvis_files = ['stops.txt', 'trips.txt', 'routes.txt', 'stop_times.txt']
+
+@metrics.stage('generate_all')
+def cpp_backend(source, out_dir):
+    if isinstance(libvis, ctypes.CDLL):
+        with source.native_dir(libvis_files) as in_dir:
+            rows = libvis.generate_all(in_dir.encode(), out_dir.encode())
+    else:
+        # the python engine streams the files from the source, even out of a zip
+        rows = libvis.generate_all(source, out_dir.encode())
+    routes_dir = os.path.join(out_dir, 'routes')
+    written = sum(entry.stat().st_size for entry in os.scandir(routes_dir) if entry.name.endswith('.json'))
+    metrics.add('generate_all', rows=rows, bytes=written)
+
+def convert_calendars_stage(source, out_dir):
+    cal_dir = os.path.join(out_dir, 'service_jkeys_by_date')
+    os.mkdir(cal_dir)
+    return convert_calendars(source, cal_dir)
+
+def convert_routes_stage(source, out_dir):
+    routes_dir = os.path.join(out_dir, 'routes')
+    return convert_routes(source, routes_dir, os.path.join(out_dir, 'visualizer.html'))
+
+def convert_shapes_stage(source, out_dir):
+    shapes_dir = os.path.join(out_dir, 'shapes')
+    os.mkdir(shapes_dir)
+    convert_shapes(source, shapes_dir)
+
+def convert_stops_stage(source, out_dir):
+    stops_dir = os.path.join(out_dir, 'stops')
+    trips_dir = os.path.join(out_dir, 'trips')
+    itin_dir = os.path.join(out_dir, 'itineraries')
+    trips_hour_dir = os.path.join(out_dir, 'trips_by_route_by_hour')
+    routes_dir = os.path.join(out_dir, 'routes')
+    os.mkdir(stops_dir)
+    os.mkdir(trips_dir)
+    os.mkdir(itin_dir)
+    os.mkdir(trips_hour_dir)
+    return convert_trips(source, stops_dir, trips_dir, itin_dir, trips_hour_dir, routes_dir)
+
+def stop_tiles_stage(stops_obj, out_dir):
+    stop_tiles.write_stop_tiles(stops_obj, os.path.join(out_dir, 'stops', 'tiles'))
+
+pipeline = Pipeline([
+    Stage('convert_calendars', convert_calendars_stage, ['source', 'out_dir'], ['service_by_date']),
+    Stage('convert_routes', convert_routes_stage, ['source', 'out_dir'], ['routes_obj']),
+    Stage('convert_shapes', convert_shapes_stage, ['source', 'out_dir'], ['shapes']),
+    Stage('convert_stops', convert_stops_stage, ['source', 'out_dir'], ['stops']),
+    Stage('stop_tiles', stop_tiles_stage, ['stops', 'out_dir'], ['stop_tiles']),
+    Stage('generate_all', cpp_backend, ['source', 'out_dir'], ['libvis']),
+    Stage('precompress', lambda out_dir, *_: compression.precompress_tree(out_dir),
+          ['out_dir', 'routes_obj', 'shapes', 'stop_tiles', 'libvis'], ['precompressed']),
+])
+
+# GTFS files each stage reads and what it writes in out_dir, so a changed feed
+# reruns only the stages it affects. stop_tiles writes inside stops
+stage_reads = {
+    'convert_calendars': ['calendar.txt', 'calendar_dates.txt'],
+    'convert_routes': ['routes.txt'],
+    'convert_shapes': ['shapes.txt'],
+    'convert_stops': ['stops.txt'],
+    'generate_all': libvis_files,
+}
+stage_writes = {
+    'convert_calendars': ['service_jkeys_by_date'],
+    'convert_routes': ['visualizer.html'],
+    'convert_shapes': ['shapes'],
+    'convert_stops': ['stops', 'trips', 'itineraries', 'trips_by_route_by_hour'],
+    'generate_all': ['routes'],
+}
+
+def convert_feed(source, out_dir):
+    # generate_all writes route files into the routes dir, convert_routes only reads routes.txt
+    os.mkdir(os.path.join(out_dir, 'routes'))
+    values, timings = pipeline.run({'source': source, 'out_dir': out_dir},
+                                   max_workers=int(os.environ.get('VIZ_PIPELINE_THREADS', 0)) or None)
+    return values['service_by_date']
+
+# converts the feed into out_dir, or copies it there from the artifact cache.
+# the caller holds libvis_lock, and gets the feed's calendar and tables, and its ids in the registry
+def build_feed(source, out_dir, cache_key, keep=3):
+    ids.clear()
+    cached = artifact_cache.load(cache_dir, cache_key, out_dir)
+    if cached is None:
+        service_by_date = convert_feed(source, out_dir)
+        tables = payload_tables.take(libvis)
+        artifact_cache.store(cache_dir, cache_key, out_dir, service_by_date, tables, keep)
+        return service_by_date, tables
+    print('Feed unchanged since last run. Serving cached vis files.')
+    return cached
+
+def load_named_feed(name):
+    source = feed_sources[name]
+    # output directories are named by fingerprint and never change once in place,
+    # so worker processes loading the same feed at once cannot step on each other
+    with libvis_lock:
+        cache_key = artifact_cache.fingerprint(source, cache_dir)
+        out_dir = os.path.join(feeds_dir, cache_key)
+        # out_dir only appears once complete: a feed dropped from feed_cache and
+        # asked for again only needs its tables, not another copy of its files
+        cached = None
+        if os.path.isdir(out_dir):
+            ids.clear()
+            cached = artifact_cache.load_tables(cache_dir, cache_key)
+
+        tmp_dir = None
+        if cached is None:
+            tmp_dir = '%s.%d.tmp' % (out_dir, os.getpid())
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            os.makedirs(tmp_dir)
+            cached = build_feed(source, tmp_dir, cache_key, keep=len(feed_sources) + 2)
+        service_by_date, tables = cached
+        feed_ids = ids.copy()
+
+    if tmp_dir is not None:
+        try:
+            os.rename(tmp_dir, out_dir)
+        except OSError:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    print('Loaded feed %s' % name)
+    shapes = shape_store.ShapeStore.open(os.path.join(out_dir, 'shapes'))
+    return feeds.Feed(name, cache_key, out_dir, service_by_date, feed_ids, shapes, tables)
+
+# hashes of the GTFS files the served feed was built from, in watch mode
+watched_hashes = {}
+generation = 0
+
+def remove_output(path):
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    for variant in [path] + [path + compression.suffix(encoding) for encoding in compression.encodings()]:
+        if os.path.isfile(variant):
+            os.remove(variant)
+
+# rebuilds the served feed after its GTFS files changed. the stages reading
+# changed files, and the ones after them, run into a new generation directory
+# where everything else is hardlinked from the live one; the server keeps
+# answering from the live feed until the new one replaces it
+def reload_feed(source):
+    global feed, generation, watched_hashes
+    with libvis_lock:
+        live = feed
+        hashes = artifact_cache.file_hashes(source, cache_dir)
+        changed = {name for name in set(hashes) | set(watched_hashes) if hashes.get(name) != watched_hashes.get(name)}
+        if not changed:
+            return
+
+        rerun = pipeline.downstream(name for name, reads in stage_reads.items() if changed.intersection(reads))
+        rerun.add('precompress')
+        print('%s changed. Rerunning %s.' % (', '.join(sorted(changed)),
+                                             ', '.join(stage.name for stage in pipeline.stages if stage.name in rerun)))
+
+        generation += 1
+        out_dir = '.visualizefiles.%d' % generation
+        shutil.rmtree(out_dir, ignore_errors=True)
+        try:
+            # stages write new files, never into linked ones: their old outputs go first
+            shutil.copytree(live.out_dir, out_dir, copy_function=os.link)
+            for stage in rerun:
+                for path in stage_writes.get(stage, []):
+                    remove_output(os.path.join(out_dir, path))
+            os.makedirs(os.path.join(out_dir, 'routes'), exist_ok=True)
+
+            values = {'source': source, 'out_dir': out_dir, 'service_by_date': live.service_by_date}
+            for stage in pipeline.stages:
+                if stage.name not in rerun:
+                    values.update((output, values.get(output)) for output in stage.outputs)
+            values, timings = pipeline.run(values, max_workers=int(os.environ.get('VIZ_PIPELINE_THREADS', 0)) or None,
+                                           only=rerun)
+
+            # the live feed reads copies, so libvis tables can be regenerated under it
+            tables = payload_tables.take(libvis) if 'generate_all' in rerun else live.tables
+            cache_key = artifact_cache.fingerprint(source, cache_dir, hashes)
+            artifact_cache.store(cache_dir, cache_key, out_dir, values['service_by_date'], tables)
+            shapes = shape_store.ShapeStore.open(os.path.join(out_dir, 'shapes'))
+        except BaseException:
+            shutil.rmtree(out_dir, ignore_errors=True)
+            raise
+
+        feed = feeds.Feed('', cache_key, out_dir, values['service_by_date'], ids, shapes, tables)
+        watched_hashes = hashes
+
+    print('Now serving %s from %s' % (source, out_dir))
+    # requests that started before the swap may still be sending files from the old generation
+    threading.Timer(60, shutil.rmtree, [live.out_dir], {'ignore_errors': True}).start()
 
 if __name__ == "__main__":
     mapbox_secret = os.environ.get('MAPBOX_KEY', None)
@@ -82,55 +585,84 @@ if __name__ == "__main__":
 
     signal.signal(signal.SIGINT, signal_handler)
 
-    gtfs_dir = ''
-
     try:
         in_dir = sys.argv[1]
     except:
-        print("Error: must specify GTFS directory as arg")
+        print("Error: must specify GTFS directory or zip file as arg")
         exit(1)
 
     try:
         shutil.rmtree('.visualizefiles')
     except:
         print('No previous visualized files found. Generating vis files.')
+    for generation_dir in glob.glob('.visualizefiles.*'):
+        shutil.rmtree(generation_dir, ignore_errors=True)
     os.makedirs('.visualizefiles', exist_ok=True)
 
-    calendar_file = os.path.join(in_dir, "calendar.txt")
-    calendar_dates_file = os.path.join(in_dir, "calendar_dates.txt")
-    cal_dir = os.path.join('.visualizefiles', 'service_jkeys_by_date')
-    os.mkdir(cal_dir)
-    service_by_date = convert_calendars(calendar_file, calendar_dates_file, cal_dir)
+    source = None
+    if in_dir != '--feeds':
+        source = open_source(in_dir)
+        if source is None:
+            print("Error: %s is neither a GTFS directory nor a zip file" % in_dir)
+            exit(1)
 
-    routes_file = os.path.join(in_dir, "routes.txt")
-    routes_dir = os.path.join('.visualizefiles', 'routes')
-    os.mkdir(routes_dir)
-    routes_obj = convert_routes(routes_file, routes_dir)
+    bench = len(sys.argv) > 2 and sys.argv[2] == 'bench'
+    if bench:
+        convert_feed(source, '.visualizefiles')
+        raise SystemExit
 
-    shapes_file = os.path.join(in_dir, "shapes.txt")
-    shapes_dir = os.path.join('.visualizefiles', 'shapes')
-    os.mkdir(shapes_dir)
-    convert_shapes(shapes_file, shapes_dir)
-
-    stops_file = os.path.join(in_dir, "stops.txt")
-    trips_file = os.path.join(in_dir, "trips.txt")
-    stop_times_file = os.path.join(in_dir, "stop_times.txt")
-    stops_dir = os.path.join('.visualizefiles', 'stops')
-    trips_dir = os.path.join('.visualizefiles', 'trips')
-    itin_dir = os.path.join('.visualizefiles', 'itineraries')
-    trips_hour_dir = os.path.join('.visualizefiles', 'trips_by_route_by_hour')
-    os.mkdir(stops_dir)
-    os.mkdir(trips_dir)
-    os.mkdir(itin_dir)
-    os.mkdir(trips_hour_dir)
-    convert_trips(stops_file, trips_file, stop_times_file, stops_dir, trips_dir, itin_dir, trips_hour_dir, routes_dir)
-    cpp_backend(in_dir, '.visualizefiles')
-    if len(sys.argv) > 2 and sys.argv[2] == 'bench':
+    # writes every response into a static directory tree, see tools/static_export.py
+    if len(sys.argv) > 2 and sys.argv[2] == 'export':
+        if len(sys.argv) < 4:
+            print("Error: export needs a directory to write the static files to")
+            exit(1)
+        cache_key = artifact_cache.fingerprint(source, cache_dir)
+        service_by_date, tables = build_feed(source, '.visualizefiles', cache_key)
+        feed = feeds.Feed('', cache_key, '.visualizefiles', service_by_date, ids,
+                          shape_store.ShapeStore.open(os.path.join('.visualizefiles', 'shapes')), tables)
+        responses, objects, size = static_export.export(feed, sys.argv[3], int(os.environ.get('VIZ_EXPORT_THREADS', 0)) or None)
+        print('Exported %d responses as %d objects (%d bytes) to %s' % (responses, objects, size, sys.argv[3]))
         raise SystemExit
 
+    watching = len(sys.argv) > 2 and sys.argv[2] == 'watch'
+    workers = int(os.environ.get('VIZ_WORKERS', 1))
+    if watching and workers > 1:
+        print("Error: watch mode reloads the feed in one process, it cannot be used with VIZ_WORKERS")
+        exit(1)
+
+    path = '/'
+    if in_dir == '--feeds':
+        try:
+            feed_sources = feeds.discover(sys.argv[2])
+        except (IndexError, OSError):
+            print("Error: --feeds needs a directory holding one GTFS directory per feed")
+            exit(1)
+        if not feed_sources:
+            print("Error: no GTFS feeds found in %s" % sys.argv[2])
+            exit(1)
+        shutil.rmtree(feeds_dir, ignore_errors=True)
+        os.makedirs(feeds_dir)
+        app.register_blueprint(feed_routes, url_prefix='/feeds/<feed_name>', name='feeds')
+        print('Serving feeds: %s' % ', '.join(feed_sources))
+        path = '/feeds/%s/' % next(iter(feed_sources))
+    else:
+        with libvis_lock:
+            watched_hashes = artifact_cache.file_hashes(source, cache_dir)
+            cache_key = artifact_cache.fingerprint(source, cache_dir, watched_hashes)
+            service_by_date, tables = build_feed(source, '.visualizefiles', cache_key)
+            feed = feeds.Feed('', cache_key, '.visualizefiles', service_by_date, ids,
+                              shape_store.ShapeStore.open(os.path.join('.visualizefiles', 'shapes')), tables)
+        if watching:
+            print('Watching %s for changes' % source)
+            watch.watch(source, lambda: reload_feed(source), float(os.environ.get('VIZ_WATCH_INTERVAL', 2)))
+
     # start server
     PORT = os.environ.get('PORT', 8000)
-    url = f'http://localhost:{PORT}/'
+    url = f'http://localhost:{PORT}{path}'
     print(f'go to {url}')
     threading.Timer(0.1111, lambda: webbrowser.open(url)).start()
-    app.run(host='0.0.0.0', port=PORT)
+    if workers > 1:
+        prefork.serve(app, '0.0.0.0', PORT, workers)
+        signal_handler(signal.SIGTERM, None)
+    else:
+        app.run(host='0.0.0.0', port=PORT)